@@ -1,16 +1,32 @@
 from flask import Flask, request, jsonify
-import boto3
+import os
+import sys
 import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from aws_clients import get_client, pool_stats
 
 ASU_ID = "1229520294"
 S3_BUCKET = f"{ASU_ID}-in-bucket"
 SIMPLEDB_TABLE = f"{ASU_ID}-simpleDB"
+# Every request thread talks to S3 (via its upload thread) and SimpleDB at the same time.
+MAX_CONCURRENCY = int(os.environ.get("WEB_MAX_CONCURRENCY", "100"))
+POOL_STATS_INTERVAL = 60
 
-s3 = boto3.client("s3", region_name="us-east-1")
-simpledb = boto3.client("sdb", region_name="us-east-1")
+s3 = get_client("s3", region_name="us-east-1", max_pool_connections=MAX_CONCURRENCY)
+simpledb = get_client("sdb", region_name="us-east-1", max_pool_connections=MAX_CONCURRENCY)
 
 app = Flask(__name__)
 
+def log_pool_stats():
+    while True:
+        time.sleep(POOL_STATS_INTERVAL)
+        print(f"[Pool Stats] AWS connection pools: {pool_stats()}")
+
+stats_thread = threading.Thread(target=log_pool_stats, daemon=True)
+stats_thread.start()
+
 def upload_file_to_s3(file_data, file_name):
     s3.put_object(Bucket=S3_BUCKET, Key=file_name, Body=file_data)
 
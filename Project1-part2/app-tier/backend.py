@@ -1,18 +1,26 @@
-import boto3
 import os
 import sys
 import asyncio
 import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 sys.path.append('/home/ec2-user/CSE546-SPRING-2025-model')
 from face_recognition import face_match
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from stage_timings import format_stage_timings
+from aws_clients import get_client, pool_stats
+
 ASU_ID = '1229520294'
 REGION = 'us-east-1'
+# Blocking boto3 calls run on this executor; the client pools are sized to match it.
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', '4'))
 
-sqs = boto3.client('sqs', region_name=REGION)
-s3 = boto3.client('s3', region_name=REGION)
+executor = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix='aws')
+sqs = get_client('sqs', region_name=REGION, max_pool_connections=WORKER_THREADS)
+s3 = get_client('s3', region_name=REGION, max_pool_connections=WORKER_THREADS)
 
 request_queue_url = sqs.get_queue_url(QueueName=f'{ASU_ID}-req-queue')['QueueUrl']
 response_queue_url = sqs.get_queue_url(QueueName=f'{ASU_ID}-resp-queue')['QueueUrl']
@@ -31,20 +39,21 @@ signal.signal(signal.SIGTERM, handle_shutdown)
 
 async def receive_message_async():
     loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, partial(
+    return await loop.run_in_executor(executor, partial(
         sqs.receive_message,
         QueueUrl=request_queue_url,
         MaxNumberOfMessages=1,
-        WaitTimeSeconds=10
+        WaitTimeSeconds=10,
+        AttributeNames=['SentTimestamp']
     ))
 
 async def download_from_s3_async(key, local_path):
     loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, partial(s3.download_file, input_bucket, key, local_path))
+    await loop.run_in_executor(executor, partial(s3.download_file, input_bucket, key, local_path))
 
 async def upload_to_s3_async(key, content):
     loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, partial(
+    await loop.run_in_executor(executor, partial(
         s3.put_object,
         Bucket=output_bucket,
         Key=key,
@@ -53,7 +62,7 @@ async def upload_to_s3_async(key, content):
 
 async def send_message_async(message):
     loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, partial(
+    await loop.run_in_executor(executor, partial(
         sqs.send_message,
         QueueUrl=response_queue_url,
         MessageBody=message
@@ -61,7 +70,7 @@ async def send_message_async(message):
 
 async def delete_message_async(receipt_handle):
     loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, partial(
+    await loop.run_in_executor(executor, partial(
         sqs.delete_message,
         QueueUrl=request_queue_url,
         ReceiptHandle=receipt_handle
@@ -73,25 +82,41 @@ async def process_request():
         print("No messages in queue.")
         return
 
+    arrival = time.time()
     message = response['Messages'][0]
     receipt_handle = message['ReceiptHandle']
     image_key = message['Body']
+    queue_wait = arrival - int(message.get('Attributes', {}).get('SentTimestamp', arrival * 1000)) / 1000
 
     print(f"Received image request: {image_key}")
     local_image_path = f'/tmp/{image_key}'
 
     await download_from_s3_async(image_key, local_image_path)
+    download_time = time.time() - arrival
 
+    recognize_start_time = time.time()
     pred_name, pred_prob = face_match(local_image_path, '/home/ec2-user/CSE546-SPRING-2025-model/data.pt')
+    recognize_time = time.time() - recognize_start_time
 
     result_key = os.path.splitext(image_key)[0]
     result_message = f"{result_key}:{pred_name}"
 
+    upload_start_time = time.time()
     await upload_to_s3_async(result_key, pred_name)
     print(f"Stored prediction '{pred_name}' in output bucket under key '{result_key}'")
+    upload_time = time.time() - upload_start_time
 
+    send_start_time = time.time()
     await send_message_async(result_message)
     print(f"Sent result to response queue: {result_message}")
+    print(format_stage_timings(
+        'app', result_key, arrival,
+        queue_wait=max(0.0, queue_wait),
+        download=download_time,
+        recognize=recognize_time,
+        upload=upload_time,
+        queue_send=time.time() - send_start_time
+    ))
 
     await delete_message_async(receipt_handle)
     print("Deleted message from request queue.")
@@ -101,6 +126,7 @@ async def worker_loop():
         await process_request()
         await asyncio.sleep(1)
 
+    print(f"AWS connection pools: {pool_stats()}")
     print("Worker exiting gracefully.")
 
 if __name__ == "__main__":
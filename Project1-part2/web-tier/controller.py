@@ -1,6 +1,10 @@
-import boto3
 import asyncio
+import os
 import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from aws_clients import get_client, get_resource
 
 ASU_ID = "1229520294"
 REGION = "us-east-1"
@@ -10,9 +14,9 @@ MAX_INSTANCES = 15
 INSTANCE_TAG_KEY = "Name"
 INSTANCE_TAG_PREFIX = "app-tier-instance-"
 
-sqs = boto3.client('sqs', region_name=REGION)
-ec2 = boto3.resource('ec2', region_name=REGION)
-client = boto3.client('ec2', region_name=REGION)
+sqs = get_client('sqs', region_name=REGION)
+ec2 = get_resource('ec2', region_name=REGION)
+client = get_client('ec2', region_name=REGION)
 
 queue_url = sqs.get_queue_url(QueueName=REQ_QUEUE)["QueueUrl"]
 
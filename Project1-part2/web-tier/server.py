@@ -1,16 +1,24 @@
 from flask import Flask, request
-import boto3
+import os
+import sys
 import threading
 import time
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from stage_timings import format_stage_timings
+from aws_clients import get_client, pool_stats
+
 ASU_ID = "1229520294"
 S3_BUCKET = f"{ASU_ID}-in-bucket"
 REQ_QUEUE = f"{ASU_ID}-req-queue"
 RESP_QUEUE = f"{ASU_ID}-resp-queue"
 REGION = "us-east-1"
+# Flask request threads each upload to S3 and send to SQS; the consumer thread adds one more SQS caller.
+MAX_CONCURRENCY = int(os.environ.get("WEB_MAX_CONCURRENCY", "100"))
+POOL_STATS_INTERVAL = 60
 
-s3 = boto3.client("s3", region_name=REGION)
-sqs = boto3.client("sqs", region_name=REGION)
+s3 = get_client("s3", region_name=REGION, max_pool_connections=MAX_CONCURRENCY)
+sqs = get_client("sqs", region_name=REGION, max_pool_connections=MAX_CONCURRENCY + 1)
 
 req_queue_url = sqs.get_queue_url(QueueName=REQ_QUEUE)["QueueUrl"]
 resp_queue_url = sqs.get_queue_url(QueueName=RESP_QUEUE)["QueueUrl"]
@@ -30,7 +38,12 @@ def send_message_to_request_queue(file_name):
 
 def response_consumer():
     print("[Consumer Thread] Started listening for responses...")
+    last_stats_time = time.time()
     while True:
+        if time.time() - last_stats_time >= POOL_STATS_INTERVAL:
+            print(f"[Consumer Thread] AWS connection pools: {pool_stats()}")
+            last_stats_time = time.time()
+
         messages = sqs.receive_message(
             QueueUrl=resp_queue_url,
             MaxNumberOfMessages=10,
@@ -69,6 +82,7 @@ def process_request():
     if not uploaded_file:
         return "No file uploaded", 400
 
+    arrival = time.time()
     file_name = uploaded_file.filename
 
     upload_thread = threading.Thread(target=upload_file_to_s3, args=(uploaded_file.read(), file_name))
@@ -81,6 +95,7 @@ def process_request():
     print(f"Filename: {file_name}")
 
     upload_thread.join()
+    upload_time = time.time() - arrival
 
     # Wait for result in shared map
     start_time = time.time()
@@ -101,6 +116,7 @@ def process_request():
             response_condition.wait(timeout=5)
 
     print(result)
+    print(format_stage_timings('web', file_name, arrival, upload=upload_time, wait=time.time() - start_time))
     return result, 200
 
 if __name__ == "__main__":
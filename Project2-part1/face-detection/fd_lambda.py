@@ -1,33 +1,47 @@
 import base64
 import json
-import boto3
 import os
 import io
+import sys
+import time
 import logging
 from PIL import Image
-from facenet_pytorch import MTCNN
+from facenet_pytorch import MTCNN, extract_face
 import torch
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from detector import detector_from_env
+from face_results import face_message, batch_entries
+from sqs_retry import send_batch_with_retry
+from stage_timings import format_stage_timings
+from aws_clients import get_client
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 sqs = None
 mtcnn = None
+detector = None
 queue_url = os.environ.get("QUEUE_URL")
+max_send_attempts = int(os.environ.get("MAX_SEND_ATTEMPTS", "4"))
 
 logger.info("Starting fd_lambda.py ...")
 
 def handler(event, context):
-    global sqs, mtcnn, queue_url
+    global sqs, mtcnn, detector, queue_url
 
     try:
+        start_time = time.time()
         if sqs is None:
             logger.info("Initializing SQS client...")
-            sqs = boto3.client("sqs", region_name="us-east-1")
+            sqs = get_client("sqs", region_name="us-east-1")
 
         if mtcnn is None:
             logger.info("Initializing MTCNN...")
             mtcnn = MTCNN(image_size=240, margin=0, min_face_size=20)
+            detector = detector_from_env(mtcnn)
+
+        init_time = time.time() - start_time
 
         body = json.loads(event.get('body', '{}'))
         image_b64 = body['content']
@@ -36,38 +50,61 @@ def handler(event, context):
 
         logger.info(f"Processing request_id={request_id}, filename={filename}")
 
+        decode_start_time = time.time()
         image_bytes = base64.b64decode(image_b64)
         image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-
-        face = mtcnn(image, return_prob=False, save_path=None)
-
-        encoded_face = None
-        if face is not None:
-            face_img = face - face.min()
-            face_img = face_img / face_img.max()
-            face_img = (face_img * 255).byte().permute(1, 2, 0).numpy()
-            face_pil = Image.fromarray(face_img, mode="RGB")
-
-            buffer = io.BytesIO()
-            face_pil.save(buffer, format="JPEG")
-            encoded_face = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            logger.info(f"Detected face...")
+        decode_time = time.time() - decode_start_time
+
+        detect_start_time = time.time()
+        boxes, probs = detector.detect(image)
+        detect_time = time.time() - detect_start_time
+
+        encode_start_time = time.time()
+        messages = []
+        if boxes is not None:
+            for face_index, box in enumerate(boxes):
+                face = extract_face(image, box, image_size=240, margin=0)
+                face_img = face - face.min()
+                face_img = face_img / face_img.max()
+                face_img = (face_img * 255).byte().permute(1, 2, 0).numpy()
+                face_pil = Image.fromarray(face_img, mode="RGB")
+
+                buffer = io.BytesIO()
+                face_pil.save(buffer, format="JPEG")
+                encoded_face = base64.b64encode(buffer.getvalue()).decode('utf-8')
+                messages.append(face_message(request_id, filename, face_index, len(boxes), box, encoded_face))
+            logger.info(f"Detected {len(messages)} faces...")
 
         else:
             logger.info("No face detected.")
+            messages.append({
+                'request_id': request_id,
+                'filename': filename,
+                'face_count': 0,
+                'face': None
+            })
 
-        message = {
-            'request_id': request_id,
-            'filename': filename,
-            'face': encoded_face
-        }
-
-        response = sqs.send_message(
-            QueueUrl=queue_url,
-            MessageBody=json.dumps(message)
-        )
-
-        logger.info(f"Message sent to SQS. Message ID: {response['MessageId']}")
+        encode_time = time.time() - encode_start_time
+
+        send_start_time = time.time()
+        undelivered = []
+        for entries in batch_entries([json.dumps(message) for message in messages]):
+            undelivered.extend(send_batch_with_retry(sqs, queue_url, entries, max_attempts=max_send_attempts))
+        logger.info(f"Sent {len(messages) - len(undelivered)} of {len(messages)} messages to SQS.")
+        if undelivered:
+            # A lost face message would leave the request without a complete response.
+            raise RuntimeError(f"{len(undelivered)} of {len(messages)} messages not delivered: "
+                               f"{undelivered[0].get('Code')}: {undelivered[0].get('Message')}")
+
+        logger.info(format_stage_timings(
+            'detection', request_id, start_time,
+            faces=0 if boxes is None else len(boxes),
+            init=init_time,
+            decode=decode_time,
+            detect=detect_time,
+            encode=encode_time,
+            queue_send=time.time() - send_start_time
+        ))
 
         return {
             "statusCode": 200,
@@ -1,6 +1,6 @@
 import os
+import sys
 import json
-import boto3
 import torch
 import numpy as np
 import logging
@@ -9,13 +9,30 @@ import base64
 from io import BytesIO
 import time
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from face_results import FaceResultAggregator, AGGREGATION_CHECK, aggregation_check_message, batch_entries
+from aggregation_store import DynamoAggregationStore
+from sqs_retry import send_batch_with_retry, dead_letter, batch_item_failures
+from stage_timings import format_stage_timings
+from aws_clients import get_client
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 sqs = None
 resnet = None
-embeddings = None
+gallery_embeddings = None
+gallery_labels = None
 queue_url = os.environ.get("QUEUE_URL")
+dlq_url = os.environ.get("DLQ_URL")
+max_send_attempts = int(os.environ.get("MAX_SEND_ATTEMPTS", "4"))
+max_receive_count = int(os.environ.get("MAX_RECEIVE_COUNT", "3"))
+gallery_path = os.environ.get("GALLERY_PATH", "resnetV1_video_weights.pt")
+aggregation_store = None
+aggregation_table = os.environ.get("AGGREGATION_TABLE")
+request_queue_url = os.environ.get("REQUEST_QUEUE_URL")
+# SQS caps DelaySeconds at 15 minutes.
+aggregation_timeout = min(900, int(os.environ.get("AGGREGATION_TIMEOUT", "60")))
 
 def decode_base64_image(base64_string):
     start_time = time.time()
@@ -33,87 +50,280 @@ def preprocess_image(image):
     return result
 
 def initialize_resources():
-    global sqs, resnet, embeddings
+    global sqs, resnet, gallery_embeddings, gallery_labels, aggregation_store
 
     start_time = time.time()
     if sqs is None:
         logger.info("Initializing SQS client...")
-        sqs = boto3.client("sqs", region_name="us-east-1")
+        sqs = get_client("sqs", region_name="us-east-1")
+
+    if aggregation_store is None and aggregation_table:
+        logger.info(f"Merging multi-face requests in DynamoDB table {aggregation_table}")
+        aggregation_store = DynamoAggregationStore(get_client("dynamodb", region_name="us-east-1"), aggregation_table)
 
     if resnet is None:
         logger.info("Loading FaceNet model...")
         resnet = torch.jit.load('resnetV1.pt').eval()
         logger.info("FaceNet model loaded.")
 
-    if embeddings is None:
+    if gallery_embeddings is None:
         logger.info("Loading precomputed embeddings...")
-        emb_tensor, labels = torch.load('resnetV1_video_weights.pt')
-        embeddings = list(zip(labels, emb_tensor))
-        logger.info(f"{len(embeddings)} embeddings loaded.")
+        if gallery_path.endswith('.npz'):
+            # Compact matrix written by tools/build_gallery.py
+            gallery = np.load(gallery_path)
+            gallery_embeddings = torch.from_numpy(gallery['embeddings'].astype(np.float32))
+            gallery_labels = gallery['labels'].tolist()
+        else:
+            emb_tensor, labels = torch.load(gallery_path)
+            gallery_embeddings = torch.stack(list(emb_tensor)).reshape(len(labels), -1)
+            gallery_labels = list(labels)
+        logger.info(f"{len(gallery_labels)} embeddings loaded.")
 
     logger.info(f"initialize_resources took {time.time() - start_time:.4f} seconds")
 
+def recognize_faces(face_tensors):
+    embedding_start_time = time.time()
+    with torch.no_grad():
+        input_embeddings = resnet(torch.cat(face_tensors))
+    embed_time = time.time() - embedding_start_time
+    logger.info(f"Embedding generation took {embed_time:.4f} seconds for {len(face_tensors)} faces")
+
+    match_start_time = time.time()
+    distances = torch.cdist(input_embeddings.reshape(len(face_tensors), -1), gallery_embeddings)
+    closest_distances, closest_indices = distances.min(dim=1)
+    match_time = time.time() - match_start_time
+    logger.info(f"Matching faces took {match_time:.4f} seconds")
+
+    results = [(gallery_labels[index], distance) for index, distance in zip(closest_indices.tolist(), closest_distances.tolist())]
+    return results, {'embed': embed_time, 'match': match_time}
+
+def parse_record(record):
+    body = json.loads(record['body'])
+    request_id = body['request_id']
+    if body.get(AGGREGATION_CHECK):
+        return {'request_id': request_id, AGGREGATION_CHECK: True}, None, {}
+
+    filename = body.get('filename')
+    face_base64 = body.get('face')
+
+    if face_base64 is None:
+        logger.info(f"No face in request {request_id} for filename: {filename}")
+        return {'request_id': request_id, 'filename': filename, 'face_count': 0}, None, {}
+
+    face_index = body.get('face_index', 0)
+    logger.info(f"Processing face {face_index} of request {request_id} for filename: {filename}")
+
+    image_start_time = time.time()
+    image = decode_base64_image(face_base64)
+    logger.info(f"Image decoding took {time.time() - image_start_time:.4f} seconds")
+
+    preprocess_start_time = time.time()
+    face_tensor = preprocess_image(image)
+    logger.info(f"Image preprocessing took {time.time() - preprocess_start_time:.4f} seconds")
+
+    sent_timestamp = record.get('attributes', {}).get('SentTimestamp')
+    timings = {'decode': time.time() - image_start_time}
+    if sent_timestamp is not None:
+        timings['queue_wait'] = max(0.0, image_start_time - int(sent_timestamp) / 1000)
+
+    face = {
+        'request_id': request_id,
+        'filename': filename,
+        'face_id': body.get('face_id', request_id),
+        'face_index': face_index,
+        'face_count': body.get('face_count', 1),
+        'box': body.get('box')
+    }
+    return face, face_tensor, timings
+
+def recognize_or_isolate(faces, face_tensors, face_records, failures, parked):
+    try:
+        return recognize_faces(face_tensors)
+    except Exception:
+        logger.exception("Batched recognition failed, retrying faces one at a time")
+
+    results = []
+    errors = []
+    timings = {'embed': 0.0, 'match': 0.0}
+    for face, face_tensor, record in zip(faces, face_tensors, face_records):
+        try:
+            face_results, face_timings = recognize_faces([face_tensor])
+            results.append(face_results[0])
+            for stage, duration in face_timings.items():
+                timings[stage] += duration
+        except Exception as e:
+            logger.exception(f"Recognition failed for {face['face_id']}")
+            errors.append((record, e))
+            results.append(None)
+
+    # When every face fails the cause is most likely the model or the runtime rather than the
+    # messages, so they are retried and only dead-lettered once SQS has delivered them
+    # max_receive_count times.
+    isolated = len(errors) < len(faces)
+    for record, e in errors:
+        receive_count = int(record.get('attributes', {}).get('ApproximateReceiveCount', 1))
+        if (isolated or receive_count >= max_receive_count) and \
+                dead_letter(sqs, dlq_url, record, f"recognition failed: {type(e).__name__}: {e}"):
+            parked.add(record['messageId'])
+        else:
+            failures.add(record['messageId'])
+    return results, timings
+
+def retry_request(request_id, sources, failures, parked):
+    for record in sources.get(request_id, []):
+        if record['messageId'] not in parked:
+            failures.add(record['messageId'])
+
+# Multi-face requests go through the aggregation store, which merges faces recognised in other
+# batches and hands out each response once. Returns the responses to send and the requests
+# still missing faces, which get a delayed check so they are answered after the timeout.
+def merge_across_batches(aggregated, checks, sources, failures, parked):
+    if aggregation_store is None:
+        # Faces split across batches are then answered as separate partial responses.
+        return aggregated, []
+
+    responses = []
+    incomplete = []
+    for response in aggregated:
+        if response['face_count'] <= 1:
+            responses.append(response)
+            continue
+        try:
+            merged = aggregation_store.add(response)
+        except Exception:
+            logger.exception(f"Storing faces of request {response['request_id']} failed")
+            retry_request(response['request_id'], sources, failures, parked)
+            continue
+        if merged is not None:
+            responses.append(merged)
+        elif not response['complete']:
+            incomplete.append(response['request_id'])
+
+    for request_id in checks:
+        try:
+            expired = aggregation_store.expire(request_id)
+        except Exception:
+            logger.exception(f"Expiring request {request_id} failed")
+            retry_request(request_id, sources, failures, parked)
+            continue
+        if expired is not None:
+            logger.warning(f"Aggregation timeout for {request_id}, answering with {len(expired['faces'])} of {expired['face_count']} faces")
+            responses.append(expired)
+    return responses, incomplete
+
+def schedule_checks(request_ids, sources, failures, parked):
+    if not request_queue_url:
+        logger.error(f"REQUEST_QUEUE_URL is not set, {len(request_ids)} incomplete requests will not time out")
+        return
+    for entries in batch_entries([json.dumps(aggregation_check_message(request_id)) for request_id in request_ids]):
+        for entry in entries:
+            entry['DelaySeconds'] = aggregation_timeout
+        for error in send_batch_with_retry(sqs, request_queue_url, entries, max_attempts=max_send_attempts):
+            logger.error(f"Aggregation check not scheduled: {error.get('Code')}: {error.get('Message')}")
+            retry_request(request_ids[int(error['Id'])], sources, failures, parked)
+
 def handler(event, context):
+    start_time = time.time()
+    records = event.get('Records', [])
+
     try:
-        start_time = time.time()
         initialize_resources()
+    except Exception:
+        logger.exception("Error initializing resources, returning the whole batch for retry")
+        return batch_item_failures(record['messageId'] for record in records)
+    init_time = time.time() - start_time
+
+    # messageIds of records whose result was not delivered; SQS redelivers only these.
+    failures = set()
+    parked = set()
+    aggregator = FaceResultAggregator()
+    aggregated = []
+    checks = []
+    sources = {}
+    faces = []
+    face_tensors = []
+    face_records = []
+    face_timings = []
+
+    for record in records:
+        try:
+            face, face_tensor, timings = parse_record(record)
+        except Exception as e:
+            logger.exception(f"Rejecting malformed message {record.get('messageId')}")
+            if not dead_letter(sqs, dlq_url, record, f"malformed message: {type(e).__name__}: {e}"):
+                failures.add(record['messageId'])
+            continue
+
+        sources.setdefault(face['request_id'], []).append(record)
+        if face.get(AGGREGATION_CHECK):
+            checks.append(face['request_id'])
+            continue
+        if face_tensor is None:
+            aggregated.append(aggregator.add(face))
+            continue
+
+        faces.append(face)
+        face_tensors.append(face_tensor)
+        face_records.append(record)
+        face_timings.append(timings)
+
+    if face_tensors:
+        results, batch_timings = recognize_or_isolate(faces, face_tensors, face_records, failures, parked)
+        for timings in face_timings:
+            timings.update({stage: duration / len(faces) for stage, duration in batch_timings.items()})
+        for face, result in zip(faces, results):
+            if result is None:
+                continue
+            closest_match, closest_distance = result
+            logger.info(f"Prediction for {face['face_id']}: {closest_match}")
+            response = aggregator.add(dict(face, result=closest_match, distance=closest_distance))
+            if response is not None:
+                aggregated.append(response)
+
+    # Requests whose remaining faces landed in another batch.
+    aggregated.extend(aggregator.flush())
+    responses, incomplete = merge_across_batches(aggregated, checks, sources, failures, parked)
+
+    send_time = 0.0
+    if responses:
+        sqs_start_time = time.time()
+        undelivered = []
+        for entries in batch_entries([json.dumps(response) for response in responses]):
+            undelivered.extend(send_batch_with_retry(sqs, queue_url, entries, max_attempts=max_send_attempts))
+        send_time = time.time() - sqs_start_time
+        logger.info(f"Sending batch to SQS took {send_time:.4f} seconds")
+        logger.info(f"Batch result sent to SQS for {len(responses) - len(undelivered)} of {len(responses)} requests.")
+
+        for error in undelivered:
+            response = responses[int(error['Id'])]
+            reason = f"result not delivered: {error.get('Code')}: {error.get('Message')}"
+            if aggregation_store is not None and response['face_count'] > 1:
+                try:
+                    aggregation_store.release(response['request_id'])
+                except Exception:
+                    logger.exception(f"Releasing request {response['request_id']} failed")
+            for record in sources.get(response['request_id'], []):
+                if record['messageId'] in failures or record['messageId'] in parked:
+                    continue
+                if not error.get('SenderFault') or not dead_letter(sqs, dlq_url, record, reason):
+                    failures.add(record['messageId'])
+
+    if incomplete:
+        schedule_checks(incomplete, sources, failures, parked)
+
+    # Batch-level work (model init, batched inference, the result send) is split evenly
+    # across the faces of the batch.
+    for face, timings in zip(faces, face_timings):
+        logger.info(format_stage_timings(
+            'recognition', face['request_id'], start_time,
+            face_index=face['face_index'],
+            batch_size=len(faces),
+            init=init_time / len(faces),
+            queue_send=send_time / len(faces),
+            **timings
+        ))
 
-        batch_messages = []
-
-        for record in event['Records']:
-            body = json.loads(record['body'])
-            request_id = body.get('request_id')
-            filename = body.get('filename')
-            face_base64 = body.get('face')
-
-            logger.info(f"Processing request for filename: {filename}")
-
-            image_start_time = time.time()
-            image = decode_base64_image(face_base64)
-            logger.info(f"Image decoding took {time.time() - image_start_time:.4f} seconds")
-
-            preprocess_start_time = time.time()
-            face_tensor = preprocess_image(image)
-            logger.info(f"Image preprocessing took {time.time() - preprocess_start_time:.4f} seconds")
-
-            embedding_start_time = time.time()
-            with torch.no_grad():
-                input_embedding = resnet(face_tensor)
-            logger.info(f"Embedding generation took {time.time() - embedding_start_time:.4f} seconds")
-
-            match_start_time = time.time()
-            closest_match = None
-            closest_distance = float('inf')
-
-            for label, stored_embedding in embeddings:
-                distance = torch.norm(input_embedding - stored_embedding).item()
-                if distance < closest_distance:
-                    closest_distance = distance
-                    closest_match = label
-            logger.info(f"Matching faces took {time.time() - match_start_time:.4f} seconds")
-
-            logger.info(f"Prediction for {request_id}: {closest_match}")
-
-            batch_messages.append({
-                'Id': request_id,
-                'MessageBody': json.dumps({
-                    "request_id": request_id,
-                    "result": closest_match
-                })
-            })
-
-        if batch_messages:
-            sqs_start_time = time.time()
-            response = sqs.send_message_batch(
-                QueueUrl=queue_url,
-                Entries=batch_messages
-            )
-            logger.info(f"Sending batch to SQS took {time.time() - sqs_start_time:.4f} seconds")
-            logger.info(f"Batch result sent to SQS for {len(batch_messages)} requests.")
-
-        logger.info(f"Total handler execution time: {time.time() - start_time:.4f} seconds")
-        return {'statusCode': 200, 'body': json.dumps('Face recognition complete.')}
-
-    except Exception as e:
-        logger.exception("Error during Lambda execution")
-        return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
+    if failures:
+        logger.warning(f"Reporting {len(failures)} of {len(records)} records as batch item failures")
+    logger.info(f"Total handler execution time: {time.time() - start_time:.4f} seconds")
+    return batch_item_failures(failures)
@@ -1,7 +1,9 @@
 import base64
 import json
-import boto3
 import io
+import os
+import sys
+import time
 import logging
 import threading
 from PIL import Image
@@ -15,14 +17,23 @@ from awsiot.greengrasscoreipc.model import (
     BinaryMessage
 )
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+from detector import detector_from_env
+from face_results import face_message, no_face_message, batch_entries
+from sqs_retry import send_batch_with_retry
+from stage_timings import format_stage_timings
+from aws_clients import get_client
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 ipc_client = GreengrassCoreIPCClientV2()
-sqs = boto3.client("sqs", region_name="us-east-1")
+sqs = get_client("sqs", region_name="us-east-1")
 request_queue_url = "https://sqs.us-east-1.amazonaws.com/402978265179/1229520294-req-queue"
 response_queue_url = "https://sqs.us-east-1.amazonaws.com/402978265179/1229520294-resp-queue"
+max_send_attempts = int(os.environ.get("MAX_SEND_ATTEMPTS", "4"))
 mtcnn = MTCNN(image_size=240, margin=0, min_face_size=20, post_process=True)
+detector = detector_from_env(mtcnn)
 
 topic_name = "clients/1229520294-IoTThing"
 
@@ -32,6 +43,7 @@ class StreamHandler:
 
     def on_stream_event(self, event: BinaryMessage):
         try:
+            start_time = time.time()
             payload = event.message.payload
             message_str = payload.decode('utf-8')
             message_json = json.loads(message_str)
@@ -43,11 +55,20 @@ class StreamHandler:
 
             image_bytes = base64.b64decode(image_b64)
             image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+            decode_time = time.time() - start_time
 
-            faces = mtcnn.detect(image)
+            detect_start_time = time.time()
+            faces = detector.detect(image)
+            detect_time = time.time() - detect_start_time
 
+            face_count = 0
+            encode_time = 0.0
+            send_start_time = time.time()
             if faces[0] is not None and len(faces[0]) > 0:
-                for face in faces[0]:
+                face_count = len(faces[0])
+                encode_start_time = time.time()
+                messages = []
+                for face_index, face in enumerate(faces[0]):
                     x1, y1, x2, y2 = [int(coord) for coord in face]
                     face_img = image.crop((x1, y1, x2, y2))
 
@@ -66,31 +87,38 @@ class StreamHandler:
                     face_pil.save(buffer, format="JPEG")
                     encoded_face = base64.b64encode(buffer.getvalue()).decode('utf-8')
 
-                    logger.info("Face detected and encoded.")
+                    messages.append(face_message(request_id, filename, face_index, len(faces[0]), face, encoded_face))
+
+                logger.info(f"{len(messages)} faces detected and encoded.")
+                encode_time = time.time() - encode_start_time
+                send_start_time = time.time()
 
-                    response = sqs.send_message(
-                        QueueUrl=request_queue_url,
-                        MessageBody=json.dumps({
-                            'request_id': request_id,
-                            'filename': filename,
-                            'face': encoded_face
-                        })
-                    )
-                    logger.info(f"Sent message to Request Queue: {request_id} : {response['MessageId']}")
+                undelivered = []
+                for entries in batch_entries([json.dumps(message) for message in messages]):
+                    undelivered.extend(send_batch_with_retry(sqs, request_queue_url, entries, max_attempts=max_send_attempts))
+                logger.info(f"Sent {len(messages) - len(undelivered)} of {len(messages)} messages to Request Queue: {request_id}")
+                if undelivered:
+                    raise RuntimeError(f"{len(undelivered)} of {len(messages)} face messages for {request_id} not delivered: "
+                                       f"{undelivered[0].get('Code')}: {undelivered[0].get('Message')}")
 
             else:
                 logger.info("No face detected.")
 
                 response = sqs.send_message(
                     QueueUrl=response_queue_url,
-                    MessageBody=json.dumps({
-                        'request_id': request_id,
-                        'filename': filename,
-                        'result': 'No-Face'
-                    })
+                    MessageBody=json.dumps(no_face_message(request_id, filename))
                 )
                 logger.info(f"Sent message to Response Queue: {request_id} : {response['MessageId']}")
 
+            logger.info(format_stage_timings(
+                'detection', request_id, start_time,
+                faces=face_count,
+                decode=decode_time,
+                detect=detect_time,
+                encode=encode_time,
+                queue_send=time.time() - send_start_time
+            ))
+
         except Exception as e:
             logger.exception(f"Error processing MQTT message: {e}")
 
@@ -0,0 +1,113 @@
+import json
+import logging
+import time
+
+from botocore.exceptions import ClientError
+
+from face_results import aggregated_response
+
+logger = logging.getLogger(__name__)
+
+FACE_PREFIX = 'face_'
+
+
+# Merges the faces of multi-face requests across recognition Lambda batches in a DynamoDB
+# table with a string partition key `request_id` (and TTL enabled on `expires_at`).
+# Every face is written to its own attribute, so concurrent batches adding different faces
+# of one request do not overwrite each other. The `emitted` flag is claimed with a
+# conditional write, so exactly one caller sends the response of a request.
+class DynamoAggregationStore:
+    def __init__(self, client, table_name, ttl=86400):
+        self.client = client
+        self.table_name = table_name
+        self.ttl = ttl
+
+    # Stores the faces of a (partial) response. Returns the merged response when it is now
+    # complete and this caller claimed it, None otherwise.
+    def add(self, response):
+        request_id = response['request_id']
+        names = {'#filename': 'filename', '#face_count': 'face_count', '#expires_at': 'expires_at'}
+        values = {
+            ':filename': {'S': response.get('filename') or ''},
+            ':face_count': {'N': str(response['face_count'])},
+            ':expires_at': {'N': str(int(time.time()) + self.ttl)}
+        }
+        updates = [
+            '#filename = if_not_exists(#filename, :filename)',
+            '#face_count = :face_count',
+            '#expires_at = if_not_exists(#expires_at, :expires_at)'
+        ]
+        for face in response['faces']:
+            index = face['face_index']
+            names[f'#face{index}'] = f'{FACE_PREFIX}{index}'
+            values[f':face{index}'] = {'S': json.dumps(face)}
+            updates.append(f'#face{index} = :face{index}')
+
+        item = self.client.update_item(
+            TableName=self.table_name,
+            Key=self._key(request_id),
+            UpdateExpression='SET ' + ', '.join(updates),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+            ReturnValues='ALL_NEW'
+        )['Attributes']
+
+        merged = self._response(item)
+        if merged['complete'] and 'emitted' not in item and self._claim(request_id):
+            return merged
+        return None
+
+    # Called once the aggregation timeout has passed. Returns the response with the faces
+    # recognised so far, or None when the request was already answered.
+    def expire(self, request_id):
+        item = self.client.get_item(
+            TableName=self.table_name,
+            Key=self._key(request_id),
+            ConsistentRead=True
+        ).get('Item')
+        if item is None or 'emitted' in item or not self._claim(request_id):
+            return None
+        return self._response(item)
+
+    # Gives up the claim after the response could not be sent, so the redelivered records
+    # can send it again.
+    def release(self, request_id):
+        self.client.update_item(
+            TableName=self.table_name,
+            Key=self._key(request_id),
+            UpdateExpression='REMOVE #emitted',
+            ExpressionAttributeNames={'#emitted': 'emitted'}
+        )
+
+    def _claim(self, request_id):
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key=self._key(request_id),
+                UpdateExpression='SET #emitted = :emitted',
+                ConditionExpression='attribute_not_exists(#emitted)',
+                ExpressionAttributeNames={'#emitted': 'emitted'},
+                ExpressionAttributeValues={':emitted': {'N': str(int(time.time()))}}
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                logger.info(f"Response for {request_id} was already sent by another invocation")
+                return False
+            raise
+        return True
+
+    def _key(self, request_id):
+        return {'request_id': {'S': request_id}}
+
+    def _response(self, item):
+        faces = {
+            int(name[len(FACE_PREFIX):]): json.loads(value['S'])
+            for name, value in item.items()
+            if name.startswith(FACE_PREFIX) and name[len(FACE_PREFIX):].isdigit()
+        }
+        return aggregated_response(
+            item['request_id']['S'],
+            item.get('filename', {}).get('S') or None,
+            int(item['face_count']['N']),
+            faces
+        )
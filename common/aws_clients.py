@@ -0,0 +1,139 @@
+import itertools
+import logging
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGION = "us-east-1"
+
+# Defaults can be overridden per deployment without code changes.
+MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "50"))
+RETRY_MODE = os.environ.get("AWS_RETRY_MODE", "adaptive")
+MAX_ATTEMPTS = int(os.environ.get("AWS_MAX_ATTEMPTS", "5"))
+CONNECT_TIMEOUT = float(os.environ.get("AWS_CONNECT_TIMEOUT", "5"))
+# Must stay above the 10 s long polls on the request and response queues.
+READ_TIMEOUT = float(os.environ.get("AWS_READ_TIMEOUT", "30"))
+TCP_KEEPALIVE = os.environ.get("AWS_TCP_KEEPALIVE", "true").lower() == "true"
+
+_session = boto3.session.Session()
+_lock = threading.Lock()
+_clients = {}
+_resources = {}
+_stats = {}
+
+
+# Tracks HTTP attempts in flight per service. An attempt that starts while every pooled
+# connection is busy opens an extra connection, which urllib3 discards afterwards with a
+# "Connection pool is full" warning.
+class PoolStats:
+    def __init__(self, max_pool_connections):
+        self.max_pool_connections = max_pool_connections
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.saturated_requests = 0
+
+    def before_send(self, **kwargs):
+        with self.lock:
+            if self.in_flight >= self.max_pool_connections:
+                self.saturated_requests += 1
+            self.in_flight += 1
+            self.requests += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def after_send(self, **kwargs):
+        with self.lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'max_pool_connections': self.max_pool_connections,
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'requests': self.requests,
+                'saturated_requests': self.saturated_requests,
+            }
+
+
+class _PoolFullCounter(logging.Filter):
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def filter(self, record):
+        if record.getMessage().startswith("Connection pool is full"):
+            self.count += 1
+        return True
+
+
+_pool_full = _PoolFullCounter()
+logging.getLogger("urllib3.connectionpool").addFilter(_pool_full)
+
+
+# Registers PoolStats on a client. Clients that differ only in their extra kwargs (such as
+# endpoint_url) have separate pools, so they get numbered entries.
+def _track(name, client, pool_size):
+    unique = name
+    for n in itertools.count(2):
+        if unique not in _stats:
+            break
+        unique = f"{name}#{n}"
+    stats = _stats[unique] = PoolStats(pool_size)
+    # needs-retry fires once after every HTTP attempt, whether it succeeded or not.
+    client.meta.events.register("before-send", stats.before_send)
+    client.meta.events.register("needs-retry", stats.after_send)
+
+
+def client_config(max_pool_connections=None, region_name=DEFAULT_REGION):
+    return Config(
+        region_name=region_name,
+        max_pool_connections=max_pool_connections or MAX_POOL_CONNECTIONS,
+        retries={'mode': RETRY_MODE, 'max_attempts': MAX_ATTEMPTS},
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        tcp_keepalive=TCP_KEEPALIVE,
+    )
+
+
+# Returns a shared client for the service, creating it on first use. Clients are thread-safe,
+# so one per (service, region, pool size) is shared by every thread of the process; size
+# max_pool_connections to the number of threads that call the service concurrently.
+def get_client(service, region_name=DEFAULT_REGION, max_pool_connections=None, **client_kwargs):
+    pool_size = max_pool_connections or MAX_POOL_CONNECTIONS
+    key = (service, region_name, pool_size, tuple(sorted(client_kwargs.items())))
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            logger.info(f"Creating {service} client (max_pool_connections={pool_size}, retries={RETRY_MODE})")
+            client = _session.client(service, config=client_config(pool_size, region_name), **client_kwargs)
+            _track(f"{service}:{region_name}:{pool_size}", client, pool_size)
+            _clients[key] = client
+        return client
+
+
+def get_resource(service, region_name=DEFAULT_REGION, max_pool_connections=None):
+    pool_size = max_pool_connections or MAX_POOL_CONNECTIONS
+    key = (service, region_name, pool_size)
+    with _lock:
+        resource = _resources.get(key)
+        if resource is None:
+            resource = _session.resource(service, config=client_config(pool_size, region_name))
+            _track(f"{service}:{region_name}:{pool_size}:resource", resource.meta.client, pool_size)
+            _resources[key] = resource
+        return resource
+
+
+# Snapshot of every shared client's pool usage, keyed "service:region:pool_size" (with a
+# ":resource" suffix for resources), plus the number of connections urllib3 discarded because
+# a pool was full.
+def pool_stats():
+    with _lock:
+        stats = {name: s.snapshot() for name, s in _stats.items()}
+    stats['discarded_connections'] = _pool_full.count
+    return stats
@@ -0,0 +1,92 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# P-Net scans 12x12 windows; pyramid levels smaller than this are never evaluated.
+PNET_CELL_SIZE = 12
+MIN_PYRAMID_FACTOR = 0.5
+
+
+# Wraps an MTCNN instance. In adaptive mode, images whose longest side exceeds max_side are
+# detected on a downscaled copy, min_face_size is rescaled to match and the pyramid factor is
+# lowered so P-Net runs on at most about max_pyramid_levels levels. Boxes are always returned
+# in the coordinates of the original image.
+class AdaptiveDetector:
+    def __init__(self, mtcnn, adaptive=True, max_side=640, max_pyramid_levels=8, single_face=False):
+        self.mtcnn = mtcnn
+        self.adaptive = adaptive
+        self.max_side = max_side
+        self.max_pyramid_levels = max_pyramid_levels
+        self.single_face = single_face
+        self.min_face_size = mtcnn.min_face_size
+        self.factor = mtcnn.factor
+        # detect() temporarily overrides MTCNN attributes, so calls must not interleave.
+        self.lock = threading.Lock()
+
+    def tune(self, width, height):
+        if not self.adaptive:
+            return 1.0, self.min_face_size, self.factor
+
+        scale = min(1.0, self.max_side / max(width, height))
+        min_face_size = max(PNET_CELL_SIZE, int(round(self.min_face_size * scale)))
+
+        factor = self.factor
+        first_level = min(width, height) * scale * PNET_CELL_SIZE / min_face_size
+        if first_level > PNET_CELL_SIZE:
+            factor = min(factor, (PNET_CELL_SIZE / first_level) ** (1.0 / self.max_pyramid_levels))
+        factor = max(factor, MIN_PYRAMID_FACTOR)
+
+        return scale, min_face_size, factor
+
+    def detect(self, image):
+        start_time = time.time()
+        width, height = image.size
+        scale, min_face_size, factor = self.tune(width, height)
+
+        working = image
+        if scale < 1.0:
+            working = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR)
+
+        with self.lock:
+            self.mtcnn.min_face_size = min_face_size
+            self.mtcnn.factor = factor
+            try:
+                boxes, probs = self.mtcnn.detect(working)
+            finally:
+                self.mtcnn.min_face_size = self.min_face_size
+                self.mtcnn.factor = self.factor
+
+        if boxes is None or len(boxes) == 0:
+            logger.info(f"Face detection took {time.time() - start_time:.4f} seconds (0 faces)")
+            return None, None
+
+        if working is not image:
+            boxes = boxes * np.array([width / working.width, height / working.height] * 2)
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+
+        if self.single_face:
+            best = int(np.argmax(probs))
+            boxes, probs = boxes[best:best + 1], probs[best:best + 1]
+
+        logger.info(
+            f"Face detection took {time.time() - start_time:.4f} seconds "
+            f"({len(boxes)} faces, scale={scale:.3f}, min_face_size={min_face_size}, factor={factor:.3f})"
+        )
+        return boxes, probs
+
+
+def detector_from_env(mtcnn):
+    return AdaptiveDetector(
+        mtcnn,
+        adaptive=os.environ.get("DETECTION_MODE", "full").lower() == "adaptive",
+        max_side=int(os.environ.get("DETECTION_MAX_SIDE", "640")),
+        max_pyramid_levels=int(os.environ.get("DETECTION_MAX_PYRAMID_LEVELS", "8")),
+        single_face=os.environ.get("DETECTION_SINGLE_FACE", "false").lower() == "true",
+    )
@@ -0,0 +1,112 @@
+# SQS caps SendMessageBatch at 10 entries and 256 KiB of payload per call.
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+NO_FACE_RESULT = 'No-Face'
+
+
+def make_face_id(request_id, face_index):
+    return f"{request_id}-{face_index}"
+
+
+def face_message(request_id, filename, face_index, face_count, box, encoded_face):
+    return {
+        'request_id': request_id,
+        'filename': filename,
+        'face_id': make_face_id(request_id, face_index),
+        'face_index': face_index,
+        'face_count': face_count,
+        'box': [int(round(coord)) for coord in box],
+        'face': encoded_face
+    }
+
+
+def no_face_message(request_id, filename):
+    return {
+        'request_id': request_id,
+        'filename': filename,
+        'face_count': 0,
+        'faces': [],
+        'complete': True,
+        'result': NO_FACE_RESULT
+    }
+
+
+def batch_entries(bodies):
+    # Entry ids are the position in bodies, so callers can map Failed entries back.
+    chunk = []
+    chunk_bytes = 0
+    for index, body in enumerate(bodies):
+        size = len(body.encode('utf-8'))
+        if chunk and (len(chunk) == MAX_BATCH_ENTRIES or chunk_bytes + size > MAX_BATCH_BYTES):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append({'Id': str(index), 'MessageBody': body})
+        chunk_bytes += size
+    if chunk:
+        yield chunk
+
+
+# Message the recognition Lambda sends to its own request queue, delayed by the aggregation
+# timeout, so a request whose remaining faces never arrive is answered with what it has.
+AGGREGATION_CHECK = 'aggregation_check'
+
+
+def aggregation_check_message(request_id):
+    return {'request_id': request_id, AGGREGATION_CHECK: True}
+
+
+def aggregated_response(request_id, filename, face_count, faces_by_index):
+    faces = [faces_by_index[index] for index in sorted(faces_by_index)]
+    return {
+        'request_id': request_id,
+        'filename': filename,
+        'face_count': face_count,
+        'faces': faces,
+        'complete': len(faces) >= face_count,
+        'result': ','.join(str(face['result']) for face in faces)
+    }
+
+
+# Groups the per-face recognition results of one Lambda batch by request. add() returns the
+# response once every face of a request has been seen; flush() returns the partial responses
+# of requests whose other faces landed in another batch. Those are merged across batches by
+# an aggregation store (common/aggregation_store.py).
+class FaceResultAggregator:
+    def __init__(self):
+        self.pending = {}
+
+    def add(self, message):
+        request_id = message['request_id']
+        face_count = message.get('face_count', 1)
+        if face_count == 0:
+            self.pending.pop(request_id, None)
+            return no_face_message(request_id, message.get('filename'))
+
+        entry = self.pending.setdefault(request_id, {
+            'request_id': request_id,
+            'filename': message.get('filename'),
+            'face_count': face_count,
+            'faces': {}
+        })
+        for face in message.get('faces', [message]):
+            entry['faces'][face['face_index']] = {
+                'face_id': face['face_id'],
+                'face_index': face['face_index'],
+                'box': face.get('box'),
+                'result': face['result'],
+                'distance': face.get('distance')
+            }
+
+        if len(entry['faces']) >= entry['face_count']:
+            del self.pending[request_id]
+            return self._response(entry)
+        return None
+
+    def flush(self):
+        responses = [self._response(entry) for entry in self.pending.values()]
+        self.pending = {}
+        return responses
+
+    def _response(self, entry):
+        return aggregated_response(entry['request_id'], entry['filename'], entry['face_count'], entry['faces'])
@@ -0,0 +1,137 @@
+import itertools
+import time
+import uuid
+from collections import defaultdict
+
+from face_results import aggregated_response
+
+
+# In-memory stand-in for the subset of the boto3 SQS client the handlers use, for exercising
+# retry and dead-letter paths without AWS. fail_next() makes the following sends fail the way
+# SQS reports them: as Failed batch entries, or a raised error for send_message.
+class LocalQueue:
+    def __init__(self):
+        self.queues = defaultdict(list)
+        self.in_flight = {}
+        self.failures = []
+        self.calls = defaultdict(int)
+        self.receipts = itertools.count()
+
+    def fail_next(self, count=1, code='ServiceUnavailable', sender_fault=False):
+        self.failures.extend([(code, sender_fault)] * count)
+
+    def _next_failure(self):
+        return self.failures.pop(0) if self.failures else None
+
+    def _enqueue(self, queue_url, body, attributes):
+        message = {
+            'MessageId': str(uuid.uuid4()),
+            'Body': body,
+            'MessageAttributes': attributes or {},
+            'Attributes': {'SentTimestamp': str(int(time.time() * 1000)), 'ApproximateReceiveCount': '0'}
+        }
+        self.queues[queue_url].append(message)
+        return message
+
+    def send_message(self, QueueUrl, MessageBody, MessageAttributes=None, **kwargs):
+        self.calls['send_message'] += 1
+        failure = self._next_failure()
+        if failure is not None:
+            raise RuntimeError(f"{failure[0]}: injected send_message failure")
+        message = self._enqueue(QueueUrl, MessageBody, MessageAttributes)
+        return {'MessageId': message['MessageId']}
+
+    def send_message_batch(self, QueueUrl, Entries, **kwargs):
+        self.calls['send_message_batch'] += 1
+        ids = [entry['Id'] for entry in Entries]
+        if len(Entries) > 10 or len(set(ids)) != len(ids):
+            raise ValueError("Batch must contain at most 10 entries with distinct Ids")
+
+        response = {'Successful': [], 'Failed': []}
+        for entry in Entries:
+            failure = self._next_failure()
+            if failure is not None:
+                response['Failed'].append({
+                    'Id': entry['Id'],
+                    'Code': failure[0],
+                    'Message': 'injected failure',
+                    'SenderFault': failure[1]
+                })
+                continue
+            message = self._enqueue(QueueUrl, entry['MessageBody'], entry.get('MessageAttributes'))
+            response['Successful'].append({'Id': entry['Id'], 'MessageId': message['MessageId']})
+        return response
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, **kwargs):
+        self.calls['receive_message'] += 1
+        queue = self.queues[QueueUrl]
+        messages = []
+        while queue and len(messages) < MaxNumberOfMessages:
+            message = queue.pop(0)
+            message['Attributes']['ApproximateReceiveCount'] = str(int(message['Attributes']['ApproximateReceiveCount']) + 1)
+            message['ReceiptHandle'] = f"receipt-{next(self.receipts)}"
+            self.in_flight[message['ReceiptHandle']] = (QueueUrl, message)
+            messages.append(message)
+        return {'Messages': messages} if messages else {}
+
+    def delete_message(self, QueueUrl, ReceiptHandle, **kwargs):
+        self.calls['delete_message'] += 1
+        self.in_flight.pop(ReceiptHandle, None)
+        return {}
+
+    def bodies(self, queue_url):
+        return [message['Body'] for message in self.queues[queue_url]]
+
+
+# In-memory stand-in for DynamoAggregationStore (common/aggregation_store.py) with the same
+# add/expire/release semantics.
+class LocalAggregationStore:
+    def __init__(self):
+        self.items = {}
+
+    def add(self, response):
+        item = self.items.setdefault(response['request_id'], {
+            'filename': response.get('filename'),
+            'faces': {},
+            'emitted': False
+        })
+        item['face_count'] = response['face_count']
+        for face in response['faces']:
+            item['faces'][face['face_index']] = face
+        merged = self._response(response['request_id'], item)
+        if merged['complete'] and not item['emitted']:
+            item['emitted'] = True
+            return merged
+        return None
+
+    def expire(self, request_id):
+        item = self.items.get(request_id)
+        if item is None or item['emitted']:
+            return None
+        item['emitted'] = True
+        return self._response(request_id, item)
+
+    def release(self, request_id):
+        if request_id in self.items:
+            self.items[request_id]['emitted'] = False
+
+    def _response(self, request_id, item):
+        return aggregated_response(request_id, item['filename'], item['face_count'], dict(item['faces']))
+
+
+# Builds a Lambda SQS event from raw message bodies, as the event source mapping would.
+def sqs_event(bodies, receive_count=1):
+    records = []
+    for body in bodies:
+        records.append({
+            'messageId': str(uuid.uuid4()),
+            'receiptHandle': str(uuid.uuid4()),
+            'body': body,
+            'attributes': {
+                'ApproximateReceiveCount': str(receive_count),
+                'SentTimestamp': str(int(time.time() * 1000))
+            },
+            'messageAttributes': {},
+            'eventSource': 'aws:sqs'
+        })
+    return {'Records': records}
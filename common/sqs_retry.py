@@ -0,0 +1,91 @@
+import json
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Sends entries with SendMessageBatch, retrying the entries SQS reports as Failed with capped
+# exponential backoff and full jitter. Entries failing with SenderFault are never retried since
+# resending the same payload cannot succeed. A call that raises has already been retried by the
+# client (see common/aws_clients.py), so its entries are returned as undelivered straight away.
+# Returns the entries that were not delivered as {'Id', 'Code', 'Message', 'SenderFault'}.
+def send_batch_with_retry(client, queue_url, entries, max_attempts=4, base_delay=0.1, max_delay=2.0, sleep=time.sleep):
+    pending = list(entries)
+    undelivered = []
+    last_errors = {}
+
+    for attempt in range(1, max_attempts + 1):
+        try:
+            response = client.send_message_batch(QueueUrl=queue_url, Entries=pending)
+            errors = response.get('Failed', [])
+        except Exception as e:
+            logger.warning(f"send_message_batch attempt {attempt} raised {type(e).__name__}: {e}")
+            undelivered.extend(
+                {'Id': entry['Id'], 'Code': type(e).__name__, 'Message': str(e), 'SenderFault': False}
+                for entry in pending
+            )
+            return undelivered
+
+        retryable = set()
+        for error in errors:
+            if error.get('SenderFault'):
+                undelivered.append(error)
+            else:
+                retryable.add(error['Id'])
+                last_errors[error['Id']] = error
+
+        pending = [entry for entry in pending if entry['Id'] in retryable]
+        if not pending:
+            break
+
+        if attempt < max_attempts:
+            delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+            logger.info(f"Retrying {len(pending)} failed batch entries (attempt {attempt + 1}/{max_attempts})")
+            sleep(random.uniform(0, delay))
+
+    for entry in pending:
+        undelivered.append(last_errors[entry['Id']])
+
+    return undelivered
+
+
+# Forwards an SQS record to the dead-letter queue with the failure reason attached as message
+# attributes. Returns False when there is no dead-letter queue or the send fails, in which case
+# the caller should report the record as a batch item failure instead.
+def dead_letter(client, dlq_url, record, reason):
+    message_id = record.get('messageId', 'unknown')
+    if not dlq_url:
+        logger.error(f"No dead-letter queue configured, cannot park message {message_id}: {reason}")
+        return False
+
+    body = record.get('body')
+    if not isinstance(body, str):
+        body = json.dumps(body)
+    if not body:
+        body = '<empty>'
+
+    try:
+        client.send_message(
+            QueueUrl=dlq_url,
+            MessageBody=body,
+            MessageAttributes={
+                'reason': {'DataType': 'String', 'StringValue': reason[:1024]},
+                'source_message_id': {'DataType': 'String', 'StringValue': message_id},
+                'receive_count': {
+                    'DataType': 'Number',
+                    'StringValue': str(record.get('attributes', {}).get('ApproximateReceiveCount', 1))
+                }
+            }
+        )
+    except Exception:
+        logger.exception(f"Failed to dead-letter message {message_id}")
+        return False
+
+    logger.warning(f"Dead-lettered message {message_id}: {reason}")
+    return True
+
+
+def batch_item_failures(message_ids):
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in sorted(message_ids)]}
@@ -0,0 +1,22 @@
+import json
+
+# One line per request (or per face in the recognition tier) listing how long each stage took,
+# in seconds. tools/workload_trace.py turns these lines into replayable workload traces.
+STAGE_TIMINGS_PREFIX = "Stage timings "
+
+
+def format_stage_timings(component, request_id, arrival, **durations):
+    record = {'component': component, 'request_id': request_id, 't': round(arrival, 4)}
+    for stage, value in durations.items():
+        record[stage] = round(value, 4) if isinstance(value, float) else value
+    return STAGE_TIMINGS_PREFIX + json.dumps(record)
+
+
+def parse_stage_timings(line):
+    index = line.find(STAGE_TIMINGS_PREFIX)
+    if index < 0:
+        return None
+    try:
+        return json.loads(line[index + len(STAGE_TIMINGS_PREFIX):].strip())
+    except ValueError:
+        return None
@@ -0,0 +1,143 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+from botocore.config import Config
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import aws_clients
+
+# Usage:
+#   python tools/benchmark_aws_clients.py --threads 10,50,200 --requests 50 --latency-ms 20
+# Runs concurrent S3 PutObject calls against a local HTTP stand-in, once with a default boto3
+# client and once with a client from aws_clients sized to the thread count, and reports
+# throughput, latency and how many TCP connections the stand-in had to accept.
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def handle_any(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            self.rfile.read(length)
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('ETag', '"d41d8cd98f00b204e9800998ecf8427e"')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_GET = do_PUT = do_POST = do_HEAD = handle_any
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Large listen backlog so connection setup, not SYN drops, is what the benchmark measures.
+    request_queue_size = 1024
+
+
+def start_stand_in(latency):
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.connections = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_client(kind, threads, endpoint):
+    credentials = {'aws_access_key_id': 'bench', 'aws_secret_access_key': 'bench', 'endpoint_url': endpoint}
+    if kind == 'default':
+        config = Config(region_name='us-east-1', s3={'addressing_style': 'path'})
+        return boto3.session.Session().client('s3', config=config, **credentials)
+    return aws_clients.get_client('s3', max_pool_connections=threads, **credentials)
+
+
+def run(client, threads, requests, body):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    start = threading.Barrier(threads + 1)
+
+    def worker(index):
+        local = []
+        start.wait()
+        for i in range(requests):
+            call_start = time.perf_counter()
+            try:
+                client.put_object(Bucket='bench', Key=f"{index}-{i}", Body=body)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                continue
+            local.append(time.perf_counter() - call_start)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    start.wait()
+    wall_start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return latencies, errors, time.perf_counter() - wall_start
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))] if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrency benchmark of boto3 client pool settings.")
+    parser.add_argument('--threads', default='10,50,200', help="Comma-separated thread counts")
+    parser.add_argument('--requests', type=int, default=50, help="Calls per thread")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="Stand-in response delay")
+    parser.add_argument('--body-bytes', type=int, default=1024)
+    args = parser.parse_args()
+
+    # urllib3 reports discarded connections at WARNING; keep them countable but off the console.
+    logging.getLogger('urllib3.connectionpool').addHandler(logging.NullHandler())
+    logging.getLogger('urllib3.connectionpool').propagate = False
+
+    server = start_stand_in(args.latency_ms / 1000)
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+    body = b'x' * args.body_bytes
+
+    print(f"{'client':>8} {'threads':>8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'new conns':>10} {'discarded':>10}")
+    for threads in [int(t) for t in args.threads.split(',')]:
+        for kind in ['default', 'factory']:
+            client = make_client(kind, threads, endpoint)
+            client.put_object(Bucket='bench', Key='warmup', Body=body)
+
+            connections_before = server.connections
+            discarded_before = aws_clients.pool_stats()['discarded_connections']
+            latencies, errors, wall = run(client, threads, args.requests, body)
+            discarded = aws_clients.pool_stats()['discarded_connections'] - discarded_before
+
+            print(f"{kind:>8} {threads:>8} {len(latencies) / wall:>9.1f} {percentile(latencies, 50) * 1000:>8.1f} "
+                  f"{percentile(latencies, 99) * 1000:>8.1f} {len(errors):>7} {server.connections - connections_before:>10} "
+                  f"{discarded:>10}")
+
+    for name, stats in aws_clients.pool_stats().items():
+        if name != 'discarded_connections':
+            print(f"{name}: {stats}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+from facenet_pytorch import MTCNN
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from detector import AdaptiveDetector
+
+# Usage:
+#   python tools/benchmark_detector.py --images frames/ --annotations boxes.json --settings full,1280,640,480
+# boxes.json maps each image filename to its ground-truth boxes: {"a.jpg": [[x1, y1, x2, y2], ...]}
+
+
+def iou(box, boxes):
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / (area + areas - inter)
+
+
+def count_matches(ground_truth, detected, threshold):
+    if detected is None or len(ground_truth) == 0:
+        return 0
+    unmatched = np.ones(len(detected), dtype=bool)
+    matches = 0
+    for box in ground_truth:
+        overlaps = iou(box, detected)
+        overlaps[~unmatched] = 0
+        best = int(np.argmax(overlaps))
+        if overlaps[best] >= threshold:
+            unmatched[best] = False
+            matches += 1
+    return matches
+
+
+def run_setting(mtcnn, setting, images, annotations, args):
+    if setting == "full":
+        detector = AdaptiveDetector(mtcnn, adaptive=False, single_face=args.single_face)
+    else:
+        detector = AdaptiveDetector(
+            mtcnn,
+            adaptive=True,
+            max_side=int(setting),
+            max_pyramid_levels=args.max_pyramid_levels,
+            single_face=args.single_face,
+        )
+
+    latencies = []
+    total_faces = 0
+    total_detections = 0
+    total_matches = 0
+
+    for filename, image in images:
+        ground_truth = np.array(annotations[filename], dtype=np.float32).reshape(-1, 4)
+        for _ in range(args.repeat):
+            start_time = time.perf_counter()
+            boxes, _ = detector.detect(image)
+            latencies.append(time.perf_counter() - start_time)
+        total_faces += len(ground_truth)
+        total_detections += 0 if boxes is None else len(boxes)
+        total_matches += count_matches(ground_truth, boxes, args.iou)
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "setting": setting,
+        "recall": total_matches / total_faces if total_faces else float("nan"),
+        "precision": total_matches / total_detections if total_detections else float("nan"),
+        "mean_ms": latencies.mean(),
+        "p50_ms": np.percentile(latencies, 50),
+        "p95_ms": np.percentile(latencies, 95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detection recall and latency per MTCNN detector setting.")
+    parser.add_argument("--images", required=True, help="Directory containing the annotated images")
+    parser.add_argument("--annotations", required=True, help="JSON file mapping filename to ground-truth boxes")
+    parser.add_argument("--settings", default="full,1280,960,640,480",
+                        help="Comma-separated list of 'full' and/or adaptive max-side values")
+    parser.add_argument("--max-pyramid-levels", type=int, default=8)
+    parser.add_argument("--single-face", action="store_true", help="Keep only the highest-probability face")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU needed for a detection to count as a hit")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per image")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed runs before measuring")
+    args = parser.parse_args()
+
+    with open(args.annotations) as f:
+        annotations = json.load(f)
+
+    images = []
+    for filename in sorted(annotations):
+        with Image.open(os.path.join(args.images, filename)) as image:
+            images.append((filename, image.convert('RGB')))
+    print(f"Loaded {len(images)} images with {sum(len(b) for b in annotations.values())} annotated faces")
+
+    mtcnn = MTCNN(image_size=240, margin=0, min_face_size=20, post_process=True)
+    for _ in range(args.warmup):
+        mtcnn.detect(images[0][1])
+
+    print(f"{'setting':>8} {'recall':>8} {'precision':>10} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for setting in args.settings.split(","):
+        result = run_setting(mtcnn, setting.strip(), images, annotations, args)
+        print(f"{result['setting']:>8} {result['recall']:>8.3f} {result['precision']:>10.3f} "
+              f"{result['mean_ms']:>9.1f} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+import torch
+from PIL import Image
+from facenet_pytorch import MTCNN, InceptionResnetV1, extract_face, fixed_image_standardization
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from detector import AdaptiveDetector
+
+# Usage:
+#   python tools/build_gallery.py faces/ --output resnetV1_video_weights --model resnetV1.pt --workers 8
+#   python tools/build_gallery.py faces/ --output data --model vggface2 --normalize standard --pt-layout app
+# faces/ holds one sub-directory per identity. Interrupted builds resume from <output>.ckpt/.
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger("build_gallery")
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+CONFIG_KEYS = ['model', 'normalize', 'image_size', 'max_side']
+
+detector = None
+resnet = None
+worker_args = None
+
+
+def list_images(root):
+    images = []
+    for label in sorted(os.listdir(root)):
+        label_dir = os.path.join(root, label)
+        if not os.path.isdir(label_dir):
+            continue
+        for dirpath, _, filenames in os.walk(label_dir):
+            for filename in sorted(filenames):
+                if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                    images.append((os.path.relpath(os.path.join(dirpath, filename), root), label))
+    return images
+
+
+def load_model(model):
+    if os.path.exists(model):
+        return torch.jit.load(model).eval()
+    return InceptionResnetV1(pretrained=model).eval()
+
+
+def init_worker(args):
+    global detector, resnet, worker_args
+    torch.set_num_threads(args.threads)
+    worker_args = args
+    mtcnn = MTCNN(image_size=args.image_size, margin=0, min_face_size=20)
+    detector = AdaptiveDetector(mtcnn, adaptive=args.max_side > 0, max_side=args.max_side, single_face=True)
+    resnet = load_model(args.model)
+
+
+def normalize_face(face):
+    if worker_args.normalize == 'standard':
+        return fixed_image_standardization(face)
+    # Same scaling the detectors apply before JPEG encoding and fr_lambda applies after decoding.
+    face = face - face.min()
+    return face / face.max()
+
+
+def embed_chunk(chunk):
+    paths, labels, faces, failed = [], [], [], []
+    for path, label in chunk:
+        try:
+            with Image.open(os.path.join(worker_args.root, path)) as image:
+                image = image.convert('RGB')
+            boxes, _ = detector.detect(image)
+            if boxes is None:
+                failed.append((path, 'no face detected'))
+                continue
+            faces.append(normalize_face(extract_face(image, boxes[0], image_size=worker_args.image_size, margin=0)))
+            paths.append(path)
+            labels.append(label)
+        except Exception as e:
+            failed.append((path, f"{type(e).__name__}: {e}"))
+
+    embeddings = torch.empty(0)
+    if faces:
+        with torch.no_grad():
+            embeddings = resnet(torch.stack(faces)).reshape(len(faces), -1)
+    return paths, labels, embeddings, failed
+
+
+class Checkpoint:
+    def __init__(self, directory, config, force=False):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        config_path = os.path.join(directory, 'config.json')
+        if os.path.exists(config_path):
+            with open(config_path) as f:
+                saved = json.load(f)
+            if saved != config and not force:
+                raise SystemExit(f"Checkpoint {directory} was built with {saved}, not {config}. Use --force to discard it.")
+            if saved != config:
+                for name in os.listdir(directory):
+                    os.remove(os.path.join(directory, name))
+        with open(config_path, 'w') as f:
+            json.dump(config, f)
+
+        self.done = set()
+        manifest = os.path.join(directory, 'done.txt')
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                self.done = {line.rstrip('\n') for line in f if line.strip()}
+        self.shards = sorted(name for name in os.listdir(directory) if name.startswith('shard-') and name.endswith('.pt'))
+        self.adopt_last_shard()
+
+        self.paths, self.labels, self.embeddings, self.failed = [], [], [], []
+
+    # A crash between renaming a shard into place and appending its images to the manifest
+    # leaves a shard the manifest does not cover. Only the newest shard can be in that state;
+    # its images are added to the manifest so they are not embedded again.
+    def adopt_last_shard(self):
+        if not self.shards:
+            return
+        shard = torch.load(os.path.join(self.directory, self.shards[-1]))
+        missing = [path for path in shard['paths'] if path not in self.done]
+        if missing:
+            logger.info(f"Adopting {len(missing)} images of {self.shards[-1]} missing from the manifest")
+            self.append_manifest(missing)
+
+    def add(self, paths, labels, embeddings, failed):
+        self.paths.extend(paths)
+        self.labels.extend(labels)
+        if len(paths):
+            self.embeddings.append(embeddings)
+        self.failed.extend(failed)
+
+    def pending(self):
+        return len(self.paths) + len(self.failed)
+
+    def flush(self):
+        if not self.pending():
+            return
+        # The shard is renamed into place before the manifest mentions its images. If the
+        # process dies in between, adopt_last_shard() completes the manifest on resume.
+        if self.paths:
+            name = f"shard-{len(self.shards):05d}.pt"
+            tmp_path = os.path.join(self.directory, name + '.tmp')
+            torch.save({'paths': self.paths, 'labels': self.labels, 'embeddings': torch.cat(self.embeddings)}, tmp_path)
+            os.replace(tmp_path, os.path.join(self.directory, name))
+            self.shards.append(name)
+
+        if self.failed:
+            with open(os.path.join(self.directory, 'failed.txt'), 'a') as f:
+                f.writelines(f"{path}\t{reason}\n" for path, reason in self.failed)
+
+        self.append_manifest(self.paths + [path for path, _ in self.failed])
+        self.paths, self.labels, self.embeddings, self.failed = [], [], [], []
+
+    def append_manifest(self, paths):
+        with open(os.path.join(self.directory, 'done.txt'), 'a') as f:
+            f.writelines(f"{path}\n" for path in paths)
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(paths)
+
+    def load(self):
+        # Images may appear in two shards if a checkpoint was resumed before its orphan
+        # shard was adopted; the first embedding of each image is kept.
+        seen = set()
+        labels, embeddings = [], []
+        for name in self.shards:
+            shard = torch.load(os.path.join(self.directory, name))
+            keep = [i for i, path in enumerate(shard['paths']) if path not in seen]
+            seen.update(shard['paths'])
+            labels.extend(shard['labels'][i] for i in keep)
+            if keep:
+                embeddings.append(shard['embeddings'][keep])
+        return labels, torch.cat(embeddings) if embeddings else torch.empty(0)
+
+
+# Adds the results of finished chunks to the checkpoint. Returns the number of images added and
+# the first exception raised by a chunk, after adding every chunk that succeeded.
+def collect(futures, checkpoint):
+    added, error = 0, None
+    for future in futures:
+        try:
+            paths, labels, embeddings, failed = future.result()
+        except Exception as e:
+            error = error or e
+            continue
+        checkpoint.add(paths, labels, embeddings, failed)
+        added += len(paths) + len(failed)
+    return added, error
+
+
+def is_unit_norm(embeddings):
+    return bool(torch.allclose(embeddings.norm(dim=1), torch.ones(len(embeddings)), atol=1e-3))
+
+
+def leader_cluster(embeddings, threshold, max_centroids):
+    # Greedy clustering: each shot joins the nearest centroid within threshold, else starts a new one.
+    centroids, counts = [], []
+    for embedding in embeddings:
+        if centroids:
+            distances = torch.stack([torch.norm(embedding - c) for c in centroids])
+            nearest = int(distances.argmin())
+            if distances[nearest] <= threshold or len(centroids) >= max_centroids:
+                counts[nearest] += 1
+                centroids[nearest] = centroids[nearest] + (embedding - centroids[nearest]) / counts[nearest]
+                continue
+        centroids.append(embedding.clone())
+        counts.append(1)
+    return centroids
+
+
+def aggregate(labels, embeddings, method, threshold, max_centroids):
+    if method == 'none':
+        return labels, embeddings
+
+    unit_norm = is_unit_norm(embeddings)
+    by_label = {}
+    for label, embedding in zip(labels, embeddings):
+        by_label.setdefault(label, []).append(embedding)
+
+    out_labels, out_embeddings = [], []
+    for label in sorted(by_label):
+        shots = torch.stack(by_label[label])
+        if method == 'mean':
+            centroids = [shots.mean(dim=0)]
+        else:
+            centroids = leader_cluster(shots, threshold, max_centroids)
+        for centroid in centroids:
+            # Averaging unit vectors shrinks them; restore the norm the matcher expects.
+            if unit_norm:
+                centroid = centroid / centroid.norm()
+            out_labels.append(label)
+            out_embeddings.append(centroid)
+    return out_labels, torch.stack(out_embeddings)
+
+
+def write_outputs(output, labels, embeddings, pt_layout, npz_dtype):
+    if pt_layout == 'app':
+        # data.pt read by the app tier's face_match: [embedding_list, name_list]
+        torch.save([list(embeddings.unsqueeze(1)), labels], output + '.pt')
+    else:
+        # resnetV1_video_weights.pt read by fr_lambda: (embeddings, labels)
+        torch.save((embeddings, labels), output + '.pt')
+    np.savez_compressed(output + '.npz', embeddings=embeddings.numpy().astype(npz_dtype), labels=np.array(labels))
+    logger.info(f"Wrote {len(labels)} gallery entries for {len(set(labels))} identities to {output}.pt and {output}.npz")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a face recognition gallery from a directory of labeled images.")
+    parser.add_argument("root", help="Directory with one sub-directory of face images per identity")
+    parser.add_argument("--output", required=True, help="Output path prefix; writes <output>.pt and <output>.npz")
+    parser.add_argument("--model", default="resnetV1.pt",
+                        help="TorchScript model path, or a facenet_pytorch pretrained name such as vggface2")
+    parser.add_argument("--normalize", choices=['minmax', 'standard'], default='minmax',
+                        help="minmax matches fr_lambda's input scaling; standard matches MTCNN post-processing")
+    parser.add_argument("--pt-layout", choices=['lambda', 'app'], default='lambda',
+                        help="lambda: (embeddings, labels) tuple; app: [embedding_list, name_list] as in data.pt")
+    parser.add_argument("--npz-dtype", choices=['float16', 'float32'], default='float16')
+    parser.add_argument("--aggregate", choices=['mean', 'cluster', 'none'], default='mean',
+                        help="How multiple shots of one identity are combined")
+    parser.add_argument("--cluster-threshold", type=float, default=0.8)
+    parser.add_argument("--max-centroids", type=int, default=4)
+    parser.add_argument("--image-size", type=int, default=240)
+    parser.add_argument("--max-side", type=int, default=640, help="Detection working resolution; 0 disables downscaling")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--threads", type=int, default=1, help="Torch threads per worker")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images embedded per forward pass")
+    parser.add_argument("--checkpoint-every", type=int, default=2048, help="Images per checkpoint shard")
+    parser.add_argument("--checkpoint-dir", help="Defaults to <output>.ckpt")
+    parser.add_argument("--force", action="store_true", help="Discard a checkpoint built with different settings")
+    args = parser.parse_args()
+
+    config = {key: getattr(args, key) for key in CONFIG_KEYS}
+    checkpoint = Checkpoint(args.checkpoint_dir or args.output + '.ckpt', config, force=args.force)
+
+    images = [image for image in list_images(args.root) if image[0] not in checkpoint.done]
+    logger.info(f"{len(checkpoint.done)} images already processed, {len(images)} remaining")
+
+    chunks = [images[i:i + args.batch_size] for i in range(0, len(images), args.batch_size)]
+    start_time = time.time()
+    processed = 0
+
+    if chunks:
+        # Flush even when a worker fails, so a rerun resumes after the last finished chunk.
+        try:
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(args,)) as executor:
+                # Bound the number of queued chunks so results are checkpointed as they arrive.
+                remaining = iter(chunks)
+                in_flight = set()
+                while True:
+                    while len(in_flight) < args.workers * 2:
+                        chunk = next(remaining, None)
+                        if chunk is None:
+                            break
+                        in_flight.add(executor.submit(embed_chunk, chunk))
+                    if not in_flight:
+                        break
+
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    added, error = collect(finished, checkpoint)
+                    processed += added
+                    if error is not None:
+                        # Keep the chunks that are already running before giving up.
+                        collect(wait(in_flight).done, checkpoint)
+                        raise error
+
+                    if checkpoint.pending() >= args.checkpoint_every:
+                        checkpoint.flush()
+                        elapsed = time.time() - start_time
+                        logger.info(f"{processed}/{len(images)} images in {elapsed:.0f} seconds ({processed / elapsed:.1f} images/s)")
+        finally:
+            checkpoint.flush()
+
+    labels, embeddings = checkpoint.load()
+    if not labels:
+        raise SystemExit("No faces were embedded; nothing to write.")
+    labels, embeddings = aggregate(labels, embeddings, args.aggregate, args.cluster_threshold, args.max_centroids)
+    write_outputs(args.output, labels, embeddings, args.pt_layout, args.npz_dtype)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import base64
+import io
+import json
+import logging
+import os
+import sys
+
+import torch
+from PIL import Image
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'common'))
+sys.path.append(os.path.join(ROOT, 'Project2-part2', 'face-recognition'))
+import fr_lambda
+from face_results import face_message
+from local_queue import LocalQueue, LocalAggregationStore, sqs_event
+
+# Usage:
+#   python tools/check_fr_lambda.py
+# Drives fr_lambda.handler against LocalQueue with a stubbed model and a three-entry gallery,
+# and checks the batchItemFailures it returns and what ends up on the response queue and the
+# dead-letter queue. The check_*_request_* and redelivery cases merge multi-face requests with
+# LocalAggregationStore in place of DynamoDB. Needs torch and Pillow, but no model weights and
+# no AWS access.
+
+REQUEST_QUEUE = 'request-queue'
+RESPONSE_QUEUE = 'response-queue'
+DLQ = 'dead-letter-queue'
+COLOURS = {'red': (255, 0, 0), 'green': (0, 255, 0), 'blue': (0, 0, 255)}
+
+
+def encode(colour, size=8):
+    buffer = io.BytesIO()
+    Image.new('RGB', (size, size), COLOURS[colour]).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+def face_body(request_id, colour, face_index=0, face_count=1):
+    return json.dumps(face_message(request_id, f"{request_id}.jpg", face_index, face_count, [0, 0, 8, 8], encode(colour)))
+
+
+def failed_ids(result):
+    return {failure['itemIdentifier'] for failure in result['batchItemFailures']}
+
+
+def setup(aggregation=False):
+    queue = LocalQueue()
+    fr_lambda.sqs = queue
+    fr_lambda.queue_url = RESPONSE_QUEUE
+    fr_lambda.dlq_url = DLQ
+    fr_lambda.request_queue_url = REQUEST_QUEUE if aggregation else None
+    fr_lambda.aggregation_store = LocalAggregationStore() if aggregation else None
+    # Mean colour of the face as its embedding, matched against one-hot colour embeddings.
+    fr_lambda.resnet = lambda batch: batch.mean(dim=(2, 3))
+    fr_lambda.gallery_embeddings = torch.eye(3)
+    fr_lambda.gallery_labels = list(COLOURS)
+    return queue
+
+
+def responses(queue):
+    return {body['request_id']: body for body in map(json.loads, queue.bodies(RESPONSE_QUEUE))}
+
+
+def check_delivered():
+    queue = setup()
+    result = fr_lambda.handler(sqs_event([face_body('a', 'red'), face_body('b', 'blue')]), None)
+    assert result == {'batchItemFailures': []}, result
+    assert {rid: r['result'] for rid, r in responses(queue).items()} == {'a': 'red', 'b': 'blue'}
+
+
+def check_send_retried():
+    queue = setup()
+    queue.fail_next(2)
+    result = fr_lambda.handler(sqs_event([face_body('a', 'red'), face_body('b', 'green')]), None)
+    assert result == {'batchItemFailures': []}, result
+    assert queue.calls['send_message_batch'] == 2, queue.calls
+    assert set(responses(queue)) == {'a', 'b'}
+
+
+def check_undelivered_reported():
+    queue = setup()
+    queue.fail_next(fr_lambda.max_send_attempts * 2)
+    event = sqs_event([face_body('a', 'red'), face_body('b', 'green')])
+    result = fr_lambda.handler(event, None)
+    assert failed_ids(result) == {record['messageId'] for record in event['Records']}, result
+    assert queue.calls['send_message_batch'] == fr_lambda.max_send_attempts, queue.calls
+    assert not queue.bodies(RESPONSE_QUEUE) and not queue.bodies(DLQ)
+
+
+def check_send_error_not_repeated():
+    queue = setup()
+
+    # The client has already retried the call, so send_batch_with_retry does not repeat it.
+    def unreachable(**kwargs):
+        queue.calls['send_message_batch'] += 1
+        raise ConnectionError("endpoint unreachable")
+    queue.send_message_batch = unreachable
+
+    event = sqs_event([face_body('a', 'red'), face_body('b', 'green')])
+    result = fr_lambda.handler(event, None)
+    assert failed_ids(result) == {record['messageId'] for record in event['Records']}, result
+    assert queue.calls['send_message_batch'] == 1, queue.calls
+
+
+def check_sender_fault_dead_lettered():
+    queue = setup()
+    queue.fail_next(1, code='InvalidMessageContents', sender_fault=True)
+    event = sqs_event([face_body('a', 'red'), face_body('b', 'green')])
+    result = fr_lambda.handler(event, None)
+    assert result == {'batchItemFailures': []}, result
+    # Sender faults are not retried.
+    assert queue.calls['send_message_batch'] == 1, queue.calls
+    assert set(responses(queue)) == {'b'}
+    parked = queue.queues[DLQ]
+    assert len(parked) == 1 and json.loads(parked[0]['Body'])['request_id'] == 'a'
+    assert parked[0]['MessageAttributes']['reason']['StringValue'].startswith('result not delivered: InvalidMessageContents')
+
+
+def check_malformed_dead_lettered():
+    queue = setup()
+    event = sqs_event(['not json', json.dumps({'filename': 'x.jpg'}), face_body('a', 'red')])
+    result = fr_lambda.handler(event, None)
+    assert result == {'batchItemFailures': []}, result
+    assert set(responses(queue)) == {'a'}
+    reasons = [message['MessageAttributes']['reason']['StringValue'] for message in queue.queues[DLQ]]
+    assert len(reasons) == 2 and all(reason.startswith('malformed message') for reason in reasons), reasons
+    assert queue.bodies(DLQ)[0] == 'not json'
+
+
+def check_malformed_without_dlq_reported():
+    queue = setup()
+    fr_lambda.dlq_url = None
+    event = sqs_event(['not json', face_body('a', 'red')])
+    result = fr_lambda.handler(event, None)
+    assert failed_ids(result) == {event['Records'][0]['messageId']}, result
+    assert set(responses(queue)) == {'a'}
+
+
+def check_model_failure_retried():
+    queue = setup()
+
+    def broken(batch):
+        raise RuntimeError("model unavailable")
+    fr_lambda.resnet = broken
+
+    event = sqs_event([face_body('a', 'red'), face_body('b', 'green')])
+    result = fr_lambda.handler(event, None)
+    assert failed_ids(result) == {record['messageId'] for record in event['Records']}, result
+    assert not queue.bodies(DLQ)
+
+    event = sqs_event([face_body('a', 'red')], receive_count=fr_lambda.max_receive_count)
+    result = fr_lambda.handler(event, None)
+    assert result == {'batchItemFailures': []}, result
+    assert len(queue.bodies(DLQ)) == 1
+
+
+def check_rejected_face_isolated():
+    queue = setup()
+    # The 16 px face breaks the batched forward pass and is rejected on its own as well.
+    model = fr_lambda.resnet
+
+    def picky(batch):
+        if batch.shape[-1] != 8:
+            raise ValueError("unexpected face size")
+        return model(batch)
+    fr_lambda.resnet = picky
+
+    result = fr_lambda.handler(sqs_event([face_body('a', 'red'), json.dumps(face_message(
+        'b', 'b.jpg', 0, 1, [0, 0, 16, 16], encode('green', size=16)))]), None)
+    assert result == {'batchItemFailures': []}, result
+    assert set(responses(queue)) == {'a'}
+    assert [json.loads(body)['request_id'] for body in queue.bodies(DLQ)] == ['b']
+
+
+def checks_sent(queue):
+    bodies = queue.bodies(REQUEST_QUEUE)
+    queue.queues[REQUEST_QUEUE].clear()
+    return bodies
+
+
+def check_split_request_merged():
+    queue = setup(aggregation=True)
+    faces = [face_body('a', colour, face_index, 3) for face_index, colour in enumerate(COLOURS)]
+
+    result = fr_lambda.handler(sqs_event(faces[:2]), None)
+    assert result == {'batchItemFailures': []}, result
+    assert not queue.bodies(RESPONSE_QUEUE)
+    assert [json.loads(body) for body in checks_sent(queue)] == [{'request_id': 'a', 'aggregation_check': True}]
+
+    result = fr_lambda.handler(sqs_event(faces[2:]), None)
+    assert result == {'batchItemFailures': []}, result
+    response = responses(queue)['a']
+    assert response['complete'] and response['result'] == 'red,green,blue', response
+    assert len(queue.bodies(RESPONSE_QUEUE)) == 1
+
+
+def check_incomplete_request_expired():
+    queue = setup(aggregation=True)
+    faces = [face_body('a', 'red', 0, 2), face_body('a', 'green', 1, 2)]
+
+    fr_lambda.handler(sqs_event(faces[:1]), None)
+    result = fr_lambda.handler(sqs_event(checks_sent(queue)), None)
+    assert result == {'batchItemFailures': []}, result
+    response = responses(queue)['a']
+    assert not response['complete'] and response['result'] == 'red', response
+
+    # The face that arrives after the timeout does not produce a second response.
+    fr_lambda.handler(sqs_event(faces[1:]), None)
+    assert len(queue.bodies(RESPONSE_QUEUE)) == 1
+
+
+def check_redelivery_after_emit_silent():
+    queue = setup(aggregation=True)
+    faces = [face_body('a', 'red', 0, 2), face_body('a', 'green', 1, 2)]
+
+    fr_lambda.handler(sqs_event(faces), None)
+    assert len(queue.bodies(RESPONSE_QUEUE)) == 1
+    assert not checks_sent(queue)
+
+    result = fr_lambda.handler(sqs_event(faces[:1], receive_count=2), None)
+    assert result == {'batchItemFailures': []}, result
+    fr_lambda.handler(sqs_event(checks_sent(queue)), None)
+    assert len(queue.bodies(RESPONSE_QUEUE)) == 1
+
+
+def check_undelivered_merged_response_resent():
+    queue = setup(aggregation=True)
+    faces = [face_body('a', 'red', 0, 2), face_body('a', 'green', 1, 2)]
+
+    queue.fail_next(fr_lambda.max_send_attempts)
+    event = sqs_event(faces)
+    result = fr_lambda.handler(event, None)
+    assert failed_ids(result) == {record['messageId'] for record in event['Records']}, result
+    assert not queue.bodies(RESPONSE_QUEUE)
+
+    result = fr_lambda.handler(sqs_event(faces, receive_count=2), None)
+    assert result == {'batchItemFailures': []}, result
+    response = responses(queue)['a']
+    assert response['complete'] and response['result'] == 'red,green', response
+    assert len(queue.bodies(RESPONSE_QUEUE)) == 1
+
+
+CHECKS = [
+    check_delivered,
+    check_send_retried,
+    check_undelivered_reported,
+    check_send_error_not_repeated,
+    check_sender_fault_dead_lettered,
+    check_malformed_dead_lettered,
+    check_malformed_without_dlq_reported,
+    check_model_failure_retried,
+    check_rejected_face_isolated,
+    check_split_request_merged,
+    check_incomplete_request_expired,
+    check_redelivery_after_emit_silent,
+    check_undelivered_merged_response_resent,
+]
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    fr_lambda.initialize_resources = lambda: None
+    for check in CHECKS:
+        check()
+        print(f"ok   {check.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,455 @@
+import argparse
+import heapq
+import itertools
+import json
+import os
+import random
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from workload_trace import read_trace, percentile, DEFAULT_STAGES
+
+# Discrete-event simulator that replays a workload trace (see workload_trace.py) through a model
+# of one of the deployments and reports response latency and instance-seconds.
+#
+#   ec2     web tier -> request queue -> app-tier EC2 workers scaled by controller.py -> response queue
+#   lambda  client -> detection Lambda -> request queue -> recognition Lambda (SQS batches) -> response queue
+#   edge    as lambda, but detection runs on a single Greengrass device
+#
+# Usage:
+#   python tools/simulate.py trace.jsonl --architecture ec2 --set max_instances=5,10,15 --set app_start_time=10,20
+# Every --set takes a comma-separated list; all combinations are simulated.
+
+PARAMETERS = {
+    # shared
+    'queue_latency': (0.02, "Seconds for a message to become receivable after it is sent"),
+    'web_timeout': (120.0, "Web tier gives up and answers Timeout after this many seconds"),
+    'speedup': (1.0, "Divide trace inter-arrival times by this factor"),
+    'drain': (60.0, "Seconds simulated after the last response, so scale-down is billed"),
+    'seed': (0, "Random seed for controller jitter"),
+    # ec2: controller.py and backend.py
+    'max_instances': (15, "MAX_INSTANCES in controller.py"),
+    'initial_instances': (0, "App-tier instances running when the trace starts"),
+    'tick_busy': (0.2, "Controller sleep when messages are pending"),
+    'tick_idle': (1.0, "Controller sleep when the queue is empty"),
+    'tick_jitter': (0.5, "Upper bound of the random jitter added to each controller sleep"),
+    'idle_ticks': (2, "Consecutive idle ticks before the controller stops instances"),
+    'pending_time': (10.0, "Seconds an instance spends in EC2 'pending' after start_instances"),
+    'app_start_time': (20.0, "Seconds from 'running' until backend.py polls the queue"),
+    'stop_time': (10.0, "Seconds an instance spends in 'stopping'"),
+    'poll_wait': (10.0, "WaitTimeSeconds of the worker's receive_message"),
+    'worker_sleep': (1.0, "Sleep between worker loop iterations"),
+    'web_upload': (0.05, "S3 upload time when the trace has no web 'upload' stage"),
+    's3_time': (0.03, "S3 download/upload time when the trace has no app-tier stages"),
+    # lambda / edge
+    'fd_concurrency': (1000, "Reserved concurrency of the detection Lambda"),
+    'fr_concurrency': (1000, "Reserved concurrency of the recognition Lambda"),
+    'cold_start': (2.0, "Init time added when no warm execution environment is free"),
+    'keep_warm': (600.0, "Seconds an idle execution environment stays warm"),
+    'fr_batch_size': (10, "BatchSize of the SQS event source mapping"),
+    'fr_batch_window': (0.0, "MaximumBatchingWindowInSeconds of the event source mapping"),
+    'fr_invoke_overhead': (0.01, "Per-invocation overhead of the recognition Lambda"),
+    'api_latency': (0.05, "Client to detection hop (function URL, or MQTT for edge)"),
+}
+
+# Service-time stages per component; waits such as queue_wait are what the model produces.
+DETECTION_STAGES = ['decode', 'detect', 'encode', 'queue_send']
+RECOGNITION_STAGES = ['decode', 'embed', 'match', 'queue_send']
+APP_STAGES = ['download', 'recognize', 'upload', 'queue_send']
+
+
+class Simulation:
+    def __init__(self, seed):
+        self.now = 0.0
+        self.events = []
+        self.sequence = itertools.count()
+        self.rng = random.Random(seed)
+        self.stopped = False
+
+    def at(self, time, callback, *args):
+        heapq.heappush(self.events, (time, next(self.sequence), callback, args))
+
+    def after(self, delay, callback, *args):
+        self.at(self.now + delay, callback, *args)
+
+    def run(self):
+        while self.events and not self.stopped:
+            self.now, _, callback, args = heapq.heappop(self.events)
+            callback(*args)
+
+
+class Metrics:
+    def __init__(self, sim, config, total):
+        self.sim = sim
+        self.config = config
+        self.total = total
+        self.latencies = []
+        self.timeouts = 0
+        self.instance_seconds = {}
+        self.peak = {}
+
+    def complete(self, request):
+        latency = self.sim.now - request['arrival']
+        if latency >= self.config['web_timeout']:
+            self.timeouts += 1
+            latency = self.config['web_timeout']
+        self.latencies.append(latency)
+        if len(self.latencies) == self.total:
+            # Keep simulating a little so idle capacity is scaled down and billed.
+            self.sim.after(self.config['drain'], self.finish)
+
+    def finish(self):
+        if self.sim.stopped:
+            return
+        self.sim.stopped = True
+        # Requests still unanswered were answered "Timeout" by the web tier.
+        missing = self.total - len(self.latencies)
+        self.timeouts += missing
+        self.latencies.extend([self.config['web_timeout']] * missing)
+
+    def bill(self, tier, seconds):
+        self.instance_seconds[tier] = self.instance_seconds.get(tier, 0.0) + seconds
+
+    def observe(self, tier, count):
+        self.peak[tier] = max(self.peak.get(tier, 0), count)
+
+    def report(self):
+        latencies = self.latencies
+        return {
+            'requests': self.total,
+            'completed': len(latencies) - self.timeouts,
+            'timeouts': self.timeouts,
+            'mean': sum(latencies) / len(latencies) if latencies else float('nan'),
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies) if latencies else float('nan'),
+            'instance_seconds': round(sum(self.instance_seconds.values()), 1),
+            'by_tier': {tier: round(seconds, 1) for tier, seconds in self.instance_seconds.items()},
+            'peak': self.peak,
+        }
+
+
+def service_time(request, component, names):
+    stages = request['stages'].get(component) or DEFAULT_STAGES.get(component, {})
+    return sum(stages.get(name, 0.0) for name in names)
+
+
+# --- ec2 ------------------------------------------------------------------------------------
+
+class Instance:
+    def __init__(self, index):
+        self.index = index
+        self.state = 'stopped'
+        self.generation = 0
+        self.started_at = None
+        self.busy = False
+        self.polling = None
+        self.shutdown = False
+
+
+class Ec2Model:
+    def __init__(self, sim, config, metrics):
+        self.sim = sim
+        self.config = config
+        self.metrics = metrics
+        self.queue = []
+        self.instances = [Instance(i) for i in range(config['max_instances'])]
+        self.idle_counter = 0
+        for instance in self.instances[:config['initial_instances']]:
+            self.start_instance(instance, booted=True)
+        sim.at(0.0, self.tick)
+
+    def arrive(self, request):
+        upload = request['stages'].get('web', {}).get('upload', self.config['web_upload'])
+        self.sim.after(upload + self.config['queue_latency'], self.enqueue, request)
+
+    def enqueue(self, request):
+        self.queue.append(request)
+        # An outstanding long poll returns as soon as a message is available.
+        for instance in self.instances:
+            if self.queue and instance.polling is not None:
+                instance.polling = None
+                self.receive(instance, instance.generation)
+
+    def app_service(self, request):
+        if 'app' in request['stages']:
+            return service_time(request, 'app', APP_STAGES)
+        # Lambda-pipeline trace: the app tier runs detection and recognition in one process.
+        faces = max(1, request['faces'])
+        recognize = service_time(request, 'detection', ['decode', 'detect'])
+        recognize += faces * service_time(request, 'recognition', ['embed', 'match'])
+        return recognize + 2 * self.config['s3_time'] + self.config['queue_latency']
+
+    # controller.py scale()
+    def tick(self):
+        if self.sim.stopped:
+            return
+        pending = len(self.queue)
+        running = [i for i in self.instances if i.state == 'running']
+        stopped = [i for i in self.instances if i.state == 'stopped']
+
+        if pending <= len(running):
+            self.idle_counter += 1
+            if self.idle_counter >= self.config['idle_ticks']:
+                to_stop = len(running) - pending
+                for instance in running[:max(0, to_stop)]:
+                    self.stop_instance(instance)
+                self.idle_counter = 0
+        else:
+            self.idle_counter = 0
+            to_start = min(pending - len(running), len(stopped), self.config['max_instances'] - len(running))
+            for instance in stopped[:max(0, to_start)]:
+                self.start_instance(instance)
+
+        sleep = self.config['tick_idle'] if pending == 0 else self.config['tick_busy']
+        self.sim.after(sleep + self.sim.rng.uniform(0, self.config['tick_jitter']), self.tick)
+
+    def start_instance(self, instance, booted=False):
+        instance.generation += 1
+        instance.started_at = self.sim.now
+        instance.shutdown = False
+        if booted:
+            instance.state = 'running'
+            self.sim.after(0.0, self.poll, instance, instance.generation)
+        else:
+            instance.state = 'pending'
+            self.sim.after(self.config['pending_time'], self.instance_running, instance, instance.generation)
+        self.metrics.observe('ec2', sum(i.state != 'stopped' for i in self.instances))
+
+    def instance_running(self, instance, generation):
+        if instance.generation != generation or instance.state != 'pending':
+            return
+        instance.state = 'running'
+        self.sim.after(self.config['app_start_time'], self.poll, instance, generation)
+
+    def stop_instance(self, instance):
+        instance.state = 'stopping'
+        instance.shutdown = True
+        instance.polling = None
+        # backend.py finishes the message it is working on before exiting.
+        if not instance.busy:
+            self.sim.after(self.config['stop_time'], self.instance_stopped, instance, instance.generation)
+
+    def instance_stopped(self, instance, generation):
+        if instance.generation != generation:
+            return
+        instance.state = 'stopped'
+        self.metrics.bill('ec2', self.sim.now - instance.started_at)
+
+    # backend.py worker_loop()
+    def poll(self, instance, generation):
+        if instance.generation != generation or instance.shutdown:
+            return
+        if self.queue:
+            self.receive(instance, generation)
+            return
+        instance.polling = self.sim.now
+        self.sim.after(self.config['poll_wait'], self.poll_timeout, instance, generation, instance.polling)
+
+    def poll_timeout(self, instance, generation, token):
+        if instance.generation != generation or instance.polling != token:
+            return
+        instance.polling = None
+        self.sim.after(self.config['worker_sleep'], self.poll, instance, generation)
+
+    def receive(self, instance, generation):
+        request = self.queue.pop(0)
+        instance.busy = True
+        self.sim.after(self.app_service(request), self.processed, instance, generation, request)
+
+    def processed(self, instance, generation, request):
+        instance.busy = False
+        self.sim.after(self.config['queue_latency'], self.metrics.complete, request)
+        if instance.shutdown:
+            self.sim.after(self.config['stop_time'], self.instance_stopped, instance, generation)
+        else:
+            self.sim.after(self.config['worker_sleep'], self.poll, instance, generation)
+
+    def close(self):
+        for instance in self.instances:
+            if instance.state != 'stopped':
+                self.metrics.bill('ec2', self.sim.now - instance.started_at)
+
+
+# --- lambda / edge --------------------------------------------------------------------------
+
+class FunctionPool:
+    def __init__(self, sim, metrics, name, concurrency, cold_start, keep_warm):
+        self.sim = sim
+        self.metrics = metrics
+        self.name = name
+        self.concurrency = concurrency
+        self.cold_start = cold_start
+        self.keep_warm = keep_warm
+        self.busy = 0
+        self.warm = []
+        self.waiting = []
+
+    def available(self):
+        return self.busy < self.concurrency
+
+    def invoke(self, duration, callback, *args):
+        if not self.available():
+            self.waiting.append((duration, callback, args))
+            return
+        self.busy += 1
+        self.metrics.observe(self.name, self.busy)
+
+        self.warm = [expiry for expiry in self.warm if expiry > self.sim.now]
+        if self.warm:
+            self.warm.pop()
+        else:
+            duration += self.cold_start
+        self.metrics.bill(self.name, duration)
+        self.sim.after(duration, self.finished, callback, args)
+
+    def finished(self, callback, args):
+        self.busy -= 1
+        self.warm.append(self.sim.now + self.keep_warm)
+        callback(*args)
+        if self.waiting and self.available():
+            duration, callback, args = self.waiting.pop(0)
+            self.invoke(duration, callback, *args)
+
+
+class LambdaModel:
+    def __init__(self, sim, config, metrics, edge=False):
+        self.sim = sim
+        self.config = config
+        self.metrics = metrics
+        self.edge = edge
+        if edge:
+            self.detection = FunctionPool(sim, metrics, 'edge', 1, 0.0, float('inf'))
+        else:
+            self.detection = FunctionPool(sim, metrics, 'fd', config['fd_concurrency'], config['cold_start'], config['keep_warm'])
+        self.recognition = FunctionPool(sim, metrics, 'fr', config['fr_concurrency'], config['cold_start'], config['keep_warm'])
+        self.queue = []
+        self.window_pending = False
+        self.remaining = {}
+
+    def arrive(self, request):
+        self.sim.after(self.config['api_latency'], self.detect, request)
+
+    def detect(self, request):
+        self.detection.invoke(service_time(request, 'detection', DETECTION_STAGES), self.detected, request)
+
+    def detected(self, request):
+        if request['faces'] == 0:
+            self.sim.after(self.config['queue_latency'], self.metrics.complete, request)
+            return
+        self.remaining[request['request_id']] = request['faces']
+        for _ in range(request['faces']):
+            self.sim.after(self.config['queue_latency'], self.enqueue, request)
+
+    # SQS event source mapping: invoke once a full batch is queued or the batching window expires.
+    def enqueue(self, request):
+        self.queue.append((self.sim.now, request))
+        self.dispatch()
+
+    def dispatch(self):
+        while self.queue and self.recognition.available():
+            oldest = self.queue[0][0]
+            window_open = self.sim.now < oldest + self.config['fr_batch_window']
+            if len(self.queue) < self.config['fr_batch_size'] and window_open:
+                if not self.window_pending:
+                    self.window_pending = True
+                    self.sim.at(oldest + self.config['fr_batch_window'], self.window_expired)
+                return
+            batch = [request for _, request in self.queue[:self.config['fr_batch_size']]]
+            del self.queue[:self.config['fr_batch_size']]
+            duration = self.config['fr_invoke_overhead'] + sum(service_time(r, 'recognition', RECOGNITION_STAGES) for r in batch)
+            self.recognition.invoke(duration, self.recognized, batch)
+
+    def window_expired(self):
+        self.window_pending = False
+        self.dispatch()
+
+    def recognized(self, batch):
+        for request in batch:
+            self.remaining[request['request_id']] -= 1
+            if self.remaining[request['request_id']] == 0:
+                del self.remaining[request['request_id']]
+                self.sim.after(self.config['queue_latency'], self.metrics.complete, request)
+        self.dispatch()
+
+    def close(self):
+        if self.edge:
+            # The edge device is powered for the whole run, busy or not.
+            self.metrics.instance_seconds['edge'] = self.sim.now
+
+
+MODELS = {
+    'ec2': Ec2Model,
+    'lambda': LambdaModel,
+    'edge': lambda sim, config, metrics: LambdaModel(sim, config, metrics, edge=True),
+}
+
+
+def simulate(requests, architecture, config):
+    sim = Simulation(config['seed'])
+    metrics = Metrics(sim, config, len(requests))
+    model = MODELS[architecture](sim, config, metrics)
+    last_arrival = 0.0
+    for request in requests:
+        request = dict(request, arrival=request['arrival'] / config['speedup'])
+        sim.at(request['arrival'], model.arrive, request)
+        last_arrival = max(last_arrival, request['arrival'])
+    # Nothing can change a result after the last request has timed out.
+    sim.at(last_arrival + config['web_timeout'] + config['drain'], metrics.finish)
+    sim.run()
+    model.close()
+    return metrics.report()
+
+
+def parse_settings(settings):
+    grid = {}
+    for setting in settings:
+        key, _, values = setting.partition('=')
+        if key not in PARAMETERS:
+            raise SystemExit(f"Unknown parameter {key!r}; see --list-params")
+        kind = type(PARAMETERS[key][0])
+        grid[key] = [kind(value) for value in values.split(',')]
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a workload trace through a model of the pipeline.")
+    parser.add_argument('trace', nargs='?')
+    parser.add_argument('--architecture', choices=sorted(MODELS), default='ec2')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=V1[,V2...]',
+                        help="Override a model parameter; comma-separated values are swept")
+    parser.add_argument('--list-params', action='store_true', help="Print the model parameters and exit")
+    parser.add_argument('--json', action='store_true', help="Print one JSON object per configuration")
+    args = parser.parse_args()
+
+    if args.list_params:
+        for key, (default, description) in PARAMETERS.items():
+            print(f"{key:>20} = {default!r:<8} {description}")
+        return
+    if not args.trace:
+        parser.error("a trace is required")
+
+    _, requests = read_trace(args.trace)
+    grid = parse_settings(args.set)
+    keys = sorted(grid)
+
+    if not args.json:
+        columns = ''.join(f"{key:>16}" for key in keys)
+        print(f"{columns}{'done':>7}{'timeout':>8}{'p50':>8}{'p90':>8}{'p99':>8}{'max':>8}{'inst-s':>10}")
+
+    for values in itertools.product(*(grid[key] for key in keys)):
+        config = {key: default for key, (default, _) in PARAMETERS.items()}
+        config.update(zip(keys, values))
+        result = simulate(requests, args.architecture, config)
+
+        if args.json:
+            print(json.dumps({'architecture': args.architecture, 'config': dict(zip(keys, values)), **result}))
+            continue
+        columns = ''.join(f"{value:>16}" for value in values)
+        print(f"{columns}{result['completed']:>7}{result['timeouts']:>8}{result['p50']:>8.2f}{result['p90']:>8.2f}"
+              f"{result['p99']:>8.2f}{result['max']:>8.2f}{result['instance_seconds']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
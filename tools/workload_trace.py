@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from stage_timings import parse_stage_timings
+
+# Workload traces are JSON lines. The first line is a header, every other line one request:
+#   {"trace_version": 1, "requests": 2, "duration": 0.4, "sources": ["fd.log", "fr.log"]}
+#   {"request_id": "a", "arrival": 0.0, "faces": 2,
+#    "stages": {"detection": {"detect": 0.31, ...}, "recognition": {"embed": 0.04, ...}}}
+# arrival is seconds since the first request. Stages are grouped by the component that logged
+# them and given in seconds; stages logged once per face (recognition) are averaged over faces.
+#
+# Usage:
+#   python tools/workload_trace.py from-logs fd.log fr.log -o trace.jsonl
+#   python tools/workload_trace.py synth --rate 5 --duration 600 --sample trace.jsonl -o load.jsonl
+#   python tools/workload_trace.py summary trace.jsonl
+
+TRACE_VERSION = 1
+NON_STAGE_FIELDS = {'component', 'request_id', 't', 'face_index', 'faces', 'batch_size'}
+
+# Used by synth when no sample trace is given, and by the simulator for components a trace
+# does not cover; roughly what the Lambda pipeline logs when warm.
+DEFAULT_STAGES = {
+    'detection': {'decode': 0.02, 'detect': 0.35, 'encode': 0.01, 'queue_send': 0.02},
+    'recognition': {'decode': 0.005, 'embed': 0.08, 'match': 0.002, 'queue_send': 0.005},
+}
+
+
+def read_trace(path):
+    with open(path) as f:
+        header = json.loads(f.readline())
+        if header.get('trace_version') != TRACE_VERSION:
+            raise ValueError(f"{path}: unsupported trace version {header.get('trace_version')}")
+        requests = [json.loads(line) for line in f if line.strip()]
+    return header, requests
+
+
+def write_trace(path, requests, **header):
+    requests = sorted(requests, key=lambda r: r['arrival'])
+    header = dict(trace_version=TRACE_VERSION, requests=len(requests),
+                  duration=requests[-1]['arrival'] if requests else 0.0, **header)
+    with open(path, 'w') as f:
+        f.write(json.dumps(header) + '\n')
+        for request in requests:
+            f.write(json.dumps(request) + '\n')
+
+
+def requests_from_logs(paths):
+    records = {}
+    for path in paths:
+        with open(path, errors='replace') as f:
+            for line in f:
+                record = parse_stage_timings(line)
+                if record is not None and 'request_id' in record and 't' in record:
+                    records.setdefault(str(record['request_id']), []).append(record)
+
+    requests = []
+    for request_id, request_records in records.items():
+        totals = {}
+        for record in request_records:
+            component = totals.setdefault(record.get('component', 'unknown'), {})
+            for stage, value in record.items():
+                if stage not in NON_STAGE_FIELDS and isinstance(value, (int, float)):
+                    component.setdefault(stage, []).append(value)
+
+        faces = [r['faces'] for r in request_records if 'faces' in r]
+        if faces:
+            face_count = max(faces)
+        else:
+            face_count = max(1, len({r['face_index'] for r in request_records if 'face_index' in r}))
+
+        requests.append({
+            'request_id': request_id,
+            'arrival': min(r['t'] for r in request_records),
+            'faces': face_count,
+            'stages': {
+                component: {stage: round(sum(values) / len(values), 4) for stage, values in stages.items()}
+                for component, stages in totals.items()
+            }
+        })
+
+    if requests:
+        first = min(r['arrival'] for r in requests)
+        for request in requests:
+            request['arrival'] = round(request['arrival'] - first, 4)
+    return requests
+
+
+def synthesize(rate, duration, sample, faces, seed):
+    rng = random.Random(seed)
+    requests = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(rate)
+        if t > duration:
+            break
+        if sample:
+            template = rng.choice(sample)
+            request = {'faces': template['faces'], 'stages': template['stages']}
+        else:
+            request = {'faces': faces, 'stages': DEFAULT_STAGES}
+        request['request_id'] = f"synth-{len(requests)}"
+        request['arrival'] = round(t, 4)
+        requests.append(request)
+    return requests
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    index = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+def summarize(path):
+    header, requests = read_trace(path)
+    duration = header.get('duration') or 0.0
+    print(f"{len(requests)} requests over {duration:.1f} s "
+          f"({len(requests) / duration if duration else float('nan'):.2f} req/s), "
+          f"{sum(r['faces'] for r in requests)} faces")
+
+    stages = sorted({(c, stage) for r in requests for c, component in r['stages'].items() for stage in component})
+    print(f"{'stage':>24} {'count':>7} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8}")
+    for component, stage in stages:
+        values = [r['stages'][component][stage] for r in requests if stage in r['stages'].get(component, {})]
+        print(f"{component + '.' + stage:>24} {len(values):>7} {sum(values) / len(values):>8.4f} "
+              f"{percentile(values, 50):>8.4f} {percentile(values, 95):>8.4f} {max(values):>8.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and inspect replayable workload traces.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    from_logs = commands.add_parser('from-logs', help="Build a trace from 'Stage timings' log lines")
+    from_logs.add_argument('logs', nargs='+', help="Log files from the web tier, app tier and Lambdas")
+    from_logs.add_argument('-o', '--output', required=True)
+
+    synth = commands.add_parser('synth', help="Generate Poisson arrivals, optionally resampling a recorded trace")
+    synth.add_argument('--rate', type=float, required=True, help="Mean arrivals per second")
+    synth.add_argument('--duration', type=float, required=True, help="Seconds of arrivals to generate")
+    synth.add_argument('--sample', help="Trace whose per-request stage times and face counts are resampled")
+    synth.add_argument('--faces', type=int, default=1, help="Faces per request when no sample is given")
+    synth.add_argument('--seed', type=int, default=0)
+    synth.add_argument('-o', '--output', required=True)
+
+    summary = commands.add_parser('summary', help="Print arrival rate and per-stage statistics")
+    summary.add_argument('trace')
+
+    args = parser.parse_args()
+
+    if args.command == 'from-logs':
+        requests = requests_from_logs(args.logs)
+        if not requests:
+            raise SystemExit("No stage timing lines found.")
+        write_trace(args.output, requests, sources=args.logs)
+        print(f"Wrote {len(requests)} requests to {args.output}")
+    elif args.command == 'synth':
+        sample = read_trace(args.sample)[1] if args.sample else None
+        requests = synthesize(args.rate, args.duration, sample, args.faces, args.seed)
+        write_trace(args.output, requests, synthetic={'rate': args.rate, 'sample': args.sample, 'seed': args.seed})
+        print(f"Wrote {len(requests)} requests to {args.output}")
+    else:
+        summarize(args.trace)
+
+
+if __name__ == "__main__":
+    main()